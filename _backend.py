@@ -1,14 +1,30 @@
-from moviepy.editor import VideoFileClip
 import numpy as np
-import soundfile as sf
 import sounddevice as sd
+from multiprocessing.shared_memory import SharedMemory
+import functools
 import threading
+import bisect
+import atexit
 import time
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Callable, Any
 from abc import ABC, abstractmethod
 
+from _decoder import (DecodeError, decoder_order, open_decoder, 
+                      decode_file, extract_audio)
+from _track import (Track, ArrayTrack, StreamTrack, LazyTrack, 
+                    ProgressiveTrack)
+from _cache import (PCMCache, DecoderCache, ExtractCache, PreloadCache,
+                    LoudnessCache)
+from _loudness import analyze_file
+from _scheduler import PreloadScheduler, mp_context
+from _ring import RingBuffer
+from _stretch import TimeStretcher
+from _equalizer import Equalizer, presets
+
 
 
 self_path = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +38,12 @@ valid_ext = [
     ".mxf", ".mka"
 ]
 
+# containers that the audio is extracted from before playing
+video_ext = valid_ext[valid_ext.index(".mp4"):]
+
+# ways of loading files that aren't cached, see set_loading
+loading_modes = ["stream", "progressive", "full"]
+
 
 
 class Backend:
@@ -39,6 +61,7 @@ class Backend:
 
     def update(self) -> None:
         self._AudioPlayer.update()
+        self._Library.update()
 
 
     class BackendClasses:
@@ -55,6 +78,45 @@ class Backend:
             self.play_queue: list[str] = []
             self.index = 0
 
+            # sorted positions of each path in the play queue
+            self.positions: dict[str, list[int]] = {}
+
+
+        def reindex(self) -> None:
+            positions: dict[str, list[int]] = {}
+            for index, path in enumerate(self.play_queue):
+                positions.setdefault(path, []).append(index)
+
+            self.positions = positions
+
+
+        def distance(self, path: str) -> int:
+            """Distance between the current index and the closest 
+            position of `path`, the queue length if it isn't queued"""
+            positions = self.positions.get(path)
+            if not positions:
+                return len(self.play_queue)
+            
+            i = bisect.bisect_left(positions, self.index)
+            
+            dist = len(self.play_queue)
+            if i < len(positions):
+                dist = positions[i] - self.index
+            if i > 0:
+                dist = min(dist, self.index - positions[i - 1])
+
+            return dist
+        
+
+        def path_at(self, index: int) -> str | None:
+            if 0 <= index < len(self.play_queue):
+                try:
+                    return self.play_queue[index]
+                except IndexError: # removed by another thread
+                    pass
+
+            return None
+
 
         def play_index(self, index: int) -> None:
             if index >= len(self.play_queue):
@@ -64,12 +126,19 @@ class Backend:
             self._AudioPlayer.play_from_start()
 
             self.index = index
+            self._AudioPlayer.notify_preloader()
 
 
-        def play_next(self) -> None:
+        def next_index(self) -> int | None:
             if len(self.play_queue) > 0:
-                index = (self.index + 1) % len(self.play_queue)
+                return (self.index + 1) % len(self.play_queue)
+            
+            return None
+
 
+        def play_next(self) -> None:
+            index = self.next_index()
+            if index is not None:
                 self.play_index(index)
 
 
@@ -89,8 +158,15 @@ class Backend:
                 self.play_queue.insert(index, path)
                 if index <= self.index:
                     self.index += 1
+
+                # shifts every later position, O(n) like the insert
+                self.reindex()
             else:
                 self.play_queue.append(path)
+                self.positions.setdefault(path, []).append(
+                    len(self.play_queue) - 1)
+
+            self._AudioPlayer.notify_preloader()
 
 
         def remove_by_index(self, index_list: list[int]) -> None:
@@ -103,10 +179,22 @@ class Backend:
                     if self.index >= new_index:
                         self.index = max(0, self.index - 1)
 
+            self.reindex()
+            self._AudioPlayer.notify_preloader()
+
 
         def swap_order(self, index1: int, index2: int) -> None:
-            self.play_queue[index1], self.play_queue[index2] = (
-                self.play_queue[index2], self.play_queue[index1])
+            path1, path2 = self.play_queue[index1], self.play_queue[index2]
+            self.play_queue[index1], self.play_queue[index2] = path2, path1
+
+            if path1 != path2:
+                for path, old, new in [(path1, index1, index2), 
+                                       (path2, index2, index1)]:
+                    positions = self.positions[path]
+                    positions.pop(bisect.bisect_left(positions, old))
+                    bisect.insort(positions, new)
+            
+            self._AudioPlayer.notify_preloader()
 
 
 
@@ -118,38 +206,189 @@ class Backend:
             self.volume = 1
             self.manual_volume = 1
 
-            self.audio_data = np.array([])
-            self.fs = 44100
+            # gain that brings files without a default volume to
+            # `target_loudness` LUFS, without raising their true peak
+            # above `peak_ceiling` dBTP
+            self.normalize = True
+            self.target_loudness = -18
+            self.peak_ceiling = -1
+            self.normalization = 1
+
+            # the output stream stays open at the device's sample rate
+            # and channels, tracks are converted to them when decoded
+            self.fs = self.device_samplerate()
+            self.channels = 2
             self.blocksize = int(self.fs / 100)
 
+            # sample format used from decoding to the output stream
+            self.dtype = "float32"
+            
+            self.track: Track = ArrayTrack(
+                np.zeros((0, self.channels), dtype=self.dtype), self.fs)
+            
+            # volume changes ramp across a block from the gain that was
+            # last applied, `ramp` goes from 1 / blocksize to 1 and has
+            # the block's shape so that nothing is broadcast
+            self.applied_volume = self.volume * self.normalization
+            self.ramp = np.zeros((0, self.channels), dtype=self.dtype)
+            self.gain = np.zeros((0, self.channels), dtype=self.dtype)
+            self.make_ramp(self.blocksize)
+
+            # the render thread reads the track into the ring buffer 
+            # ahead of the stream callback, which only copies out of it
+            self.ring_slots = 8
+            self.ring = RingBuffer(self.ring_slots, 
+                                   self.blocksize, 
+                                   self.channels, 
+                                   self.dtype)
+            
+            # bumped when the track or position changes, 
+            # blocks rendered before that are skipped
+            self.generation = 0
+            self.render_position = 0
+            self.render_wake = threading.Event()
+
+            # when a track ends, the render thread continues with the 
+            # next one in the play queue if it is preloaded, `item` 
+            # counts the tracks rendered so the switch can be noticed 
+            # once it is heard, `switch` is the (item, path, queue index,
+            # previous track) of a switch that isn't heard yet
+            self.gapless = True
+            self.item = 0
+            self.switch: tuple[int, str, int, Track | None] | None = None
+
+            # seconds that the end of a track is mixed with the start 
+            # of the next one, 0 only switches gaplessly
+            self.crossfade = 0.0
+            self.max_crossfade = 12
+            self.crossfade_curve = "equal_power"
+
+            # the track fading out, its position, the gains of both
+            # tracks over the fade and the frames of the fade done
+            self.fading: Track | None = None
+            self.fade_position = 0
+            self.fade_in = np.zeros((0, 1), dtype=self.dtype)
+            self.fade_out = np.zeros((0, 1), dtype=self.dtype)
+            self.fade_done = 0
+            self.fade_buffer = np.zeros((self.blocksize, self.channels),
+                                        dtype=self.dtype)
+            
+            # playback speed without changing the pitch, the track is
+            # time stretched by the render thread when it isn't 1 
+            # and timestamps stay in track time
+            self.speed = 1.0
+            self.min_speed = 0.5
+            self.max_speed = 2
+            self.stretcher = TimeStretcher(self.fs, 
+                                           self.channels, 
+                                           self.blocksize, 
+                                           self.dtype)
+            self.stretch_buffer = np.zeros((self.blocksize, self.channels),
+                                           dtype=self.dtype)
+            
+            # applied to the rendered blocks, bypassed while flat
+            self.equalizer = Equalizer(self.fs, 
+                                       self.channels, 
+                                       self.blocksize, 
+                                       self.dtype)
+            self.equalizer_preset = "flat"
+            
+            self.renderer = threading.Thread(
+                target=self.render_loop,
+                daemon=True)
+
+            # held while the track is read, replaced or seeked
+            self.track_lock = threading.Lock()
+
             self.current_path = ""
 
-            self.preload_data_key: list[str] = []
-            self.preload_data: list[tuple[np.ndarray, int]] = []
-            self.preload_buffer_size = 2
+            # how files that aren't cached are loaded, see set_loading
+            self.loading = "stream"
+            self.stream_buffer_blocks = 32
+
+            self.decoder_cache = DecoderCache(
+                os.path.join(self_path, "data", "decoder_cache.json"))
+
+            self.pcm_cache = PCMCache(
+                os.path.join(self_path, "data", "pcm_cache"),
+                max_bytes=2 * 1024 ** 3)
+
+            # tracks within `preload_distance` of the queue index are
+            # preloaded, as long as they fit in the memory budget
+            self.preload_cache = PreloadCache(
+                max_bytes=1024 ** 3,
+                on_evict=self.release_shared)
+            self.preload_distance = 2
+
+            # preloads are decoded in worker processes and 
+            # returned through shared memory
+            self.preload_workers = 2
+            self.scheduler = PreloadScheduler(
+                self.preload_workers,
+                on_done=self.notify_preloader)
+            self.preload_shm: dict[str, SharedMemory] = {}
+            self.released_shm: list[SharedMemory] = []
+
+            # set when the play queue changes or a preload finishes,
+            # the preloader sleeps until then
+            self.preload_event = threading.Event()
+
+            # how long load_file waits for a preload of the same file
+            # that is already decoding, when loading would block anyway
+            self.preload_wait = 2
+
+            # files that failed to decode, the number of failures
+            # and the time they can be retried at, changed on the Tk
+            # thread and the preloader under `failure_lock`
+            self.decode_failures: dict[str, tuple[int, float]] = {}
+            self.failure_lock = threading.Lock()
+            self.retry_delay = 1
+            self.max_retry_delay = 300
 
             self.preloader = threading.Thread(
                 target=self.preload,
                 daemon=True)
 
+            # idle, starting, running or stopping, 
+            # changed under `stream_lock`
+            self.stream_state = "idle"
+            self.stream_lock = threading.Lock()
+            self.stream_stop = threading.Event()
+            self.stream_error: Exception | None = None
+            self.stop_timeout = 1
+
             self.thread = threading.Thread(
                 target=self.thread_stream,
                 daemon=True)
-            self.terminate = False
+            atexit.register(self.stop_stream)
 
             self.default_volume: list[float] = []
             self.volume_key_list: list[str] = []
             self.load_default_volume()
 
 
+        def device_samplerate(self) -> int:
+            try:
+                device = sd.query_devices(kind="output")
+                return int(device["default_samplerate"])
+            except (sd.PortAudioError, ValueError):
+                return 44100
+
+
         def play(self) -> None:
             if not self.playing:
                 self.playing = True
+                self.render_wake.set()
 
 
         def play_from_start(self) -> None:
-            self.timestamp = 0
+            self.play_from(0)
+
+
+        def play_from(self, timestamp: float) -> None:
+            self.goto_time(timestamp)
             self.playing = True
+            self.render_wake.set()
         
         
         def pause(self) -> None:
@@ -159,15 +398,72 @@ class Backend:
 
         def invert_play_state(self) -> None:
             self.playing = not self.playing
+            self.render_wake.set()
 
 
         def goto_time(self, timestamp: float) -> None:
-            self.timestamp = int(timestamp * self.fs)
+            frame = int(timestamp * self.fs)
+
+            with self.track_lock:
+                self.end_fade()
+
+                self.generation += 1
+                self.render_position = frame
+                self.timestamp = frame
+                self.track.seek(frame)
+                self.stretcher.reset()
+
+            self.render_wake.set()
 
 
         def set_volume(self, volume: float) -> None:
             self.volume = volume
             self.manual_volume = volume
+
+
+        def set_crossfade(self, 
+                          seconds: float, 
+                          curve: str = "equal_power") -> None:
+            if curve not in ["linear", "equal_power"]:
+                raise ValueError(f"unknown crossfade curve {curve}")
+            
+            self.crossfade = min(max(seconds, 0), self.max_crossfade)
+            self.crossfade_curve = curve
+
+
+        def set_loading(self, mode: str) -> None:
+            """Sets how the next files are loaded. "stream" decodes 
+            into a small buffer while playing, so memory use doesn't
+            depend on the length of the file. "progressive" decodes the
+            whole file into memory in the background, starting where it
+            is played, so seeking back doesn't decode again. "full" 
+            decodes the whole file before playing"""
+            if mode not in loading_modes:
+                raise ValueError(f"unknown loading mode {mode}")
+            
+            self.loading = mode
+
+
+        def set_equalizer(self, gains: tuple[float, ...]) -> None:
+            """Sets the gain of each band in dB"""
+            with self.track_lock:
+                self.equalizer.set_gains(gains)
+
+            self.equalizer_preset = next(
+                (name for name, preset in presets.items() 
+                 if preset == self.equalizer.gains), "custom")
+            
+
+        def set_equalizer_preset(self, name: str) -> None:
+            if name not in presets:
+                raise ValueError(f"unknown equalizer preset {name}")
+            
+            self.set_equalizer(presets[name])
+
+
+        def set_speed(self, speed: float) -> None:
+            self.speed = min(max(speed, self.min_speed), self.max_speed)
+            self.render_wake.set()
         
 
         def get_timestamp(self) -> float:
@@ -175,7 +471,21 @@ class Backend:
         
 
         def get_duration(self) -> float:
-            return self.audio_data.shape[0] / self.fs
+            return self.track.frames / self.fs
+        
+
+        def is_buffering(self) -> bool:
+            return (self.playing 
+                    and self.ring.empty()
+                    and self.track.buffering(self.render_position))
+        
+
+        def track_ended(self) -> bool:
+            """Whether the track was rendered to the end 
+            and everything rendered was played"""
+            return (self.track.ended(self.render_position) 
+                    and self.stretcher.empty()
+                    and self.ring.empty())
         
 
         def load_default_volume(self) -> None:
@@ -217,127 +527,396 @@ class Backend:
             if path in self.volume_key_list:
                 index = self.volume_key_list.index(path)
                 self.volume = self.default_volume[index]
+                self.normalization = 1
             else:
                 self.volume = self.manual_volume
+                self.normalization = self.normalization_gain(path)
+
+
+        def normalization_gain(self, path: str) -> float:
+            if not self.normalize:
+                return 1
+            
+            analysis = self._Library.loudness_cache.get(path)
+            if analysis is None or analysis["loudness"] is None:
+                return 1
+            
+            gain = self.target_loudness - analysis["loudness"]
+            if analysis["peak"] is not None:
+                gain = min(gain, self.peak_ceiling - analysis["peak"])
+
+            return 10 ** (gain / 20)
 
 
         def preload(self) -> None:
+            self.scheduler.start()
+            atexit.register(self.shutdown_preloader)
+
+            self.preload_event.set()
+
             while True:
-                play_queue = self._PlayQueue.play_queue.copy()
-                index = self._PlayQueue.index
+                self.preload_event.wait(self.retry_timeout())
+                self.preload_event.clear()
 
-                dist_list = [
-                    self.dist_from_index(path, index, play_queue) 
-                    for path in self.preload_data_key]
+                distance = self._PlayQueue.distance
                 
-                if len(dist_list) == 0:
-                    dist_list = [0]
-                
-                if max(dist_list) > self.preload_buffer_size:
-                    index = dist_list.index(max(dist_list))
-                    self.preload_data.pop(index)
-                    self.preload_data_key.pop(index)
+                self.preload_cache.evict(distance, self.preload_distance)
+
+                for finished in self.scheduler.finished():
+                    self.add_preload(*finished, distance)
                     
-                path = self.preload_choice()
-                if path:
-                    self.preload_file(path)
-                
-                time.sleep(0.1)
+                self.scheduler.schedule(self.preload_jobs(distance), 
+                                        self.dtype, 
+                                        self.fs, 
+                                        self.channels)
+
+                self.close_released()
 
 
-        def dist_from_index(self, 
-                            element: Any,
-                            index: int,
-                            target_list: list[Any]) -> int:
+        def notify_preloader(self) -> None:
+            self.preload_event.set()
+
+
+        def preload_offsets(self) -> list[int]:
+            """Offsets from the queue index in preload priority order, 
+            the next track, the previous one, the current one, 
+            then further ahead before further behind"""
+            ahead = list(range(2, self.preload_distance + 1))
+            behind = [-offset for offset in ahead]
+
+            return [1, -1, 0] + ahead + behind
+
+
+        def preload_jobs(self, 
+                         distance: Callable[[str], int]
+                         ) -> list[tuple[int, str, str, list[str]]]:
+            """Preloads to decode as (priority, path, file to decode, 
+            decoder order), tracks in the PCM cache are added directly"""
+            queue_index = self._PlayQueue.index
+            jobs = []
+            seen = set()
             
-            upper_list = target_list[index:]
-            lower_list = target_list[:index + 1][::-1]
+            for priority, offset in enumerate(self.preload_offsets()):
+                path = self._PlayQueue.path_at(queue_index + offset)
+                if path is None or path in seen:
+                    continue
 
-            if element in upper_list:
-                upper_dist = upper_list.index(element)
-            else:
-                upper_dist = len(target_list)
+                seen.add(path)
 
-            if element in lower_list:
-                lower_dist = lower_list.index(element)
-            else:
-                lower_dist = len(target_list)
+                if (path in self.preload_cache
+                    or not self.preload_cache.fits(path, distance)
+                    or not self.can_retry(path)):
+                    continue
 
-            return min(upper_dist, lower_dist)
+                source = self._Library.resolve(path)
 
+                result = self.open_cached(source)
+                if result is not None:
+                    self.preload_cache.add(path, *result, distance)
+                    continue
+
+                jobs.append(
+                    (priority, path, source, self.decoder_order(source)))
+                
+            return jobs
+                
 
-        def preload_choice(self) -> str | None:
-            for i in range(self.preload_buffer_size + 1):
-                for sign in [1, -1]:
-                    index = sign * i + self._PlayQueue.index
+        def add_preload(self, 
+                        path: str,
+                        source: str,
+                        result: Any,
+                        failed: bool,
+                        distance: Callable[[str], int]
+                        ) -> tuple[np.ndarray, int] | None:
+            """Adds a finished preload to the cache, returns the 
+            decoded audio even if it didn't fit in the cache"""
+            if failed:
+                self.record_failure(path)
+                return None
+
+            if result is None:
+                self.decoder_cache.record(source, "")
+                self.record_failure(path)
+                return None
+
+            self.clear_failure(path)
+
+            name, shape, fs, decoder = result
+            self.decoder_cache.record(source, decoder)
 
-                    if not 0 <= index < len(self._PlayQueue.play_queue):
-                        continue
-                    else:
-                        path = self._PlayQueue.play_queue[index]
+            try:
+                shm = SharedMemory(name=name)
+            except FileNotFoundError:
+                # the block manager exited with the interpreter
+                return None
+            
+            audio_data = np.ndarray(shape, 
+                                    dtype=self.dtype, 
+                                    buffer=shm.buf)
+            
+            self.preload_shm[path] = shm
+            if not self.preload_cache.add(path, audio_data, fs, distance):
+                self.release_shared(path)
 
-                    if path not in self.preload_data_key:
-                        return path
-                    
+            return audio_data, fs
+        
 
-        def preload_file(self, path: str) -> None:
-            if path in self.preload_data_key:
+        def store_played(self, 
+                         path: str, 
+                         audio_data: np.ndarray, 
+                         fs: int) -> None:
+            """Writes a preloaded track to the PCM cache once it is 
+            played, so that preloads that are skipped don't take the 
+            place of tracks that are played again"""
+            if isinstance(audio_data, np.memmap):
+                # opened from the PCM cache
                 return
             
-            try:
-                audio_data, fs = sf.read(path)
-            except sf.LibsndfileError:
-                try:
-                    audio = VideoFileClip(path).audio
-                    if audio is not None:
-                        audio_data = audio.to_soundarray()
-                        fs = audio.fps
-                    else:
-                        return
-                except KeyError:
-                    return
+            # the shared memory stays mapped while the array is used
+            threading.Thread(
+                target=self.pcm_cache.store,
+                args=(self._Library.resolve(path), audio_data, fs),
+                daemon=True).start()
+
+
+        def wait_preload(self, path: str) -> tuple[np.ndarray, int] | None:
+            """Takes the result of a preload of `path` that is already
+            decoding instead of decoding the file a second time"""
+            if path not in self.scheduler:
+                return None
+            
+            timeout = 0
+            if self.loading == "full":
+                timeout = self.preload_wait
+            
+            finished = self.scheduler.wait(path, timeout)
+            if finished is None:
+                # not started yet or too slow, it is loaded directly,
+                # the preloader cancels it once it isn't wanted
+                return None
+            
+            return self.add_preload(*finished, self._PlayQueue.distance)
+
+
+        def record_failure(self, path: str) -> None:
+            with self.failure_lock:
+                failures, retry_time = self.decode_failures.get(path, 
+                                                                (0, 0))
+                delay = min(self.retry_delay * 2 ** failures, 
+                            self.max_retry_delay)
                 
-            self.preload_data_key.append(path)
-            self.preload_data.append((audio_data, fs))
+                self.decode_failures[path] = (failures + 1, 
+                                              time.time() + delay)
 
 
-        def load_file(self, path: str) -> None:
-            self.stop_stream()
+        def clear_failure(self, path: str) -> None:
+            with self.failure_lock:
+                self.decode_failures.pop(path, None)
 
-            if path in self.preload_data_key:
-                index = self.preload_data_key.index(path)
 
-                self.audio_data, self.fs = self.preload_data[index]
-                self.blocksize = int(self.fs / 100)
+        def retry_timeout(self) -> float | None:
+            """Time until the next failed file can be retried"""
+            now = time.time()
+            with self.failure_lock:
+                retry_times = [
+                    retry_time for failures, retry_time 
+                    in self.decode_failures.values() if retry_time > now]
+            
+            if len(retry_times) == 0:
+                return None
+            
+            return min(retry_times) - now
 
-                self.current_path = path
 
-            else:
+        def can_retry(self, path: str) -> bool:
+            with self.failure_lock:
+                failures, retry_time = self.decode_failures.get(path, 
+                                                                (0, 0))
+            if time.time() < retry_time:
+                return False
+                
+            source = self._Library.resolve(path)
+            if self.decoder_cache.failed(source):
+                # no decoder could read the file since it last changed
+                self.record_failure(path)
+                return False
+            
+            return True
+        
+
+        def has_failed(self, path: str) -> bool:
+            """Whether the last attempt to decode `path` failed"""
+            return path in self.decode_failures
+
+
+        def release_shared(self, path: str) -> None:
+            if path in self.preload_shm:
+                shm = self.preload_shm.pop(path)
+                self.scheduler.release_block(shm.name)
+
+                # closed once the track using it is gone
+                self.released_shm.append(shm)
+
+
+        def close_released(self) -> None:
+            for shm in self.released_shm.copy():
                 try:
-                    self.audio_data, self.fs = sf.read(path)
-                    self.blocksize = int(self.fs / 100)
+                    shm.close()
+                except BufferError:
+                    continue
 
-                    self.current_path = path
+                self.released_shm.remove(shm)
 
-                except sf.LibsndfileError:
-                    try:
-                        audio = VideoFileClip(path).audio
-                        if audio is not None:
-                            self.audio_data = audio.to_soundarray()
-                            self.fs = audio.fps
-                            self.blocksize = int(self.fs / 100)
 
-                            self.current_path = path
-                            
-                        else:
-                            self.audio_data = np.array([])
-                    except KeyError:
-                        self.audio_data = np.array([])
+        def shutdown_preloader(self) -> None:
+            for path in list(self.preload_shm):
+                self.release_shared(path)
+
+            self.scheduler.shutdown()
+
+
+        def open_track(self, path: str) -> Track | None:
+            path = self._Library.resolve(path)
+
+            result = self.open_cached(path)
+            if result is not None:
+                return ArrayTrack(*result)
+
+            if self.decoder_cache.failed(path):
+                return None
+
+            order = self.decoder_order(path)
+            try:
+                decoder, name = open_decoder(path, self.dtype, order)
+                self.decoder_cache.record(path, name)
+
+                decoder = decoder.convert(self.fs, self.channels)
+            except DecodeError:
+                decoder = None
+
+            if decoder is not None and self.loading == "stream":
+                writer = self.pcm_cache.writer(
+                    path, decoder.fs, decoder.channels)
+                
+                return StreamTrack(decoder, 
+                                   int(decoder.fs / 100),
+                                   self.stream_buffer_blocks,
+                                   writer)
+            
+            store = functools.partial(self.pcm_cache.store, path)
+            
+            if decoder is not None and self.loading == "progressive":
+                if decoder.seekable:
+                    # playable from any position before it is decoded
+                    return LazyTrack(decoder, 
+                                     int(decoder.fs / 10), 
+                                     on_complete=store)
+                
+                return ProgressiveTrack(decoder,
+                                        int(decoder.fs / 10),
+                                        on_complete=store)
+            
+            if decoder is not None:
+                audio_data = decoder.read_all()
+                decoder.close()
+
+                result = None
+                if audio_data.shape[0] > 0:
+                    result = audio_data, decoder.fs
+            else:
+                # the block decoders already failed in open_decoder
+                result = decode_file(path, self.dtype, ["moviepy"], 
+                                     fs=self.fs, channels=self.channels)
+                if result is None:
+                    self.decoder_cache.record(path, "")
+                    return None
+                
+                audio_data, fs, name = result
+                self.decoder_cache.record(path, name)
+                result = audio_data, fs
+            
+            if result is not None:
+                threading.Thread(
+                    target=store,
+                    args=result,
+                    daemon=True).start()
+                
+                return ArrayTrack(*result)
+            
+
+        def open_cached(self, path: str) -> tuple[np.ndarray, int] | None:
+            """Opens a decoded track from the PCM cache if it was 
+            stored in the format of the output stream"""
+            result = self.pcm_cache.open(path, self.dtype)
+            if result is None:
+                return None
+            
+            audio_data, fs = result
+            if fs != self.fs or audio_data.shape[1] != self.channels:
+                return None
+            
+            return result
+
+
+        def decoder_order(self, path: str) -> list[str]:
+            return decoder_order(path, self.decoder_cache.get(path))
+            
+
+        def set_track(self, track: Track, path: str) -> None:
+            with self.track_lock:
+                self.end_fade()
+                
+                previous = self.track
+                self.track = track
+
+                self.generation += 1
+                self.render_position = 0
+                self.timestamp = 0
+                self.item += 1
+                self.stretcher.reset()
+
+                switch = self.switch
+                self.switch = None
+
+            self.render_wake.set()
+
+            previous.close()
+            if switch is not None and switch[3] is not None:
+                switch[3].close()
+
+            self.current_path = path
+
+
+        def clear_track(self) -> None:
+            self.set_track(ArrayTrack(
+                np.zeros((0, self.channels), dtype=self.dtype), self.fs),
+                self.current_path)
+
+
+        def load_file(self, path: str) -> None:
+            self.clear_track()
+
+            preloaded = self.preload_cache.get(path)
+            if preloaded is None:
+                preloaded = self.wait_preload(path)
+
+            if preloaded is not None:
+                self.set_track(ArrayTrack(*preloaded), path)
+                self.store_played(path, *preloaded)
+
+            else:
+                track = self.open_track(path)
+                if track is not None:
+                    self.set_track(track, path)
+                    self.clear_failure(path)
+                else:
+                    self.record_failure(path)
 
 
             self.do_default_volume(path)
 
-            self.start_stream()
+            if self.stream_state == "idle":
+                self.start_stream()
 
 
         def stream_callback(self, 
@@ -346,60 +925,380 @@ class Backend:
                             time: Any, 
                             status: sd.CallbackFlags) -> None:
             
-            end = self.timestamp + frames
-            chunk = self.audio_data[self.timestamp:end]
+            # runs on the audio thread, it only copies what the 
+            # render thread prepared and allocates no buffers
+            frames_read = 0
+
+            if self.playing:
+                frames_read = self.ring.read_into(outdata, self.generation)
+                if frames_read > 0:
+                    self.timestamp = self.ring.position
+
+            outdata[frames_read:] = 0
+            self.apply_gain(outdata)
+
+
+        def apply_gain(self, outdata: np.ndarray) -> None:
+            volume = self.volume * self.normalization
+            previous = self.applied_volume
 
-            if len(chunk.shape) != 2:
+            if volume == previous:
+                np.multiply(outdata, volume, out=outdata)
                 return
+            
+            frames = outdata.shape[0]
+            if frames != self.ramp.shape[0]:
+                # only if the device changes the block size
+                self.make_ramp(frames)
 
-            outdata[:] = np.zeros((frames, chunk.shape[1]))
+            np.multiply(self.ramp, volume - previous, out=self.gain)
+            np.add(self.gain, previous, out=self.gain)
+            np.multiply(outdata, self.gain, out=outdata)
+
+            self.applied_volume = volume
+
+
+        def make_ramp(self, frames: int) -> None:
+            ramp = np.linspace(1 / frames, 1, frames, dtype=self.dtype)
+            
+            self.ramp = np.repeat(ramp[:, np.newaxis], self.channels, 
+                                  axis=1)
+            self.gain = np.empty_like(self.ramp)
+
+
+        def render_loop(self) -> None:
+            # woken on seeks, track and state changes, and polls twice 
+            # per block for free slots only while the stream is playing
+            interval = self.blocksize / self.fs / 2
+
+            while True:
+                timeout = None
+                if self.playing and self.stream_state == "running":
+                    timeout = interval
+
+                self.render_wake.wait(timeout)
+                self.render_wake.clear()
+
+                self.render()
+
+
+        def render(self) -> None:
+            """Fills the free slots of the ring buffer from the track"""
+            while not self.ring.full():
+                with self.track_lock:
+                    slot = self.ring.slot()
+
+                    if self.speed != 1 or not self.stretcher.empty():
+                        frames = self.render_stretched(slot)
+                    else:
+                        frames = self.render_direct(slot)
+
+                    if frames == 0:
+                        return
+
+
+        def render_direct(self, slot: np.ndarray) -> int:
+            frames = self.read_track(slot)
+            if frames > 0:
+                self.commit(slot, frames, self.render_position, self.item)
+                self.render_position += frames
+
+            return frames
+                    
+
+        def read_track(self, block: np.ndarray) -> int:
+            """Reads the track at `render_position` into `block`, mixed
+            with the crossfade and continuing into the next track, 
+            returns the frames read. `render_position` isn't moved"""
+            while True:
+                self.start_fade()
+
+                out = block
+                if self.crossfade > 0 and self.fading is None:
+                    # ends the block where the fade starts
+                    before_fade = (self.track.frames 
+                                   - self.render_position
+                                   - int(self.crossfade * self.fs))
+                    if 0 < before_fade < block.shape[0]:
+                        out = block[:before_fade]
+
+                frames = self.track.read_into(out, self.render_position)
+                if self.fading is not None:
+                    frames = self.mix_fade(out, frames)
+
+                if frames > 0 or not self.render_next():
+                    return frames
+                
+
+        def render_stretched(self, slot: np.ndarray) -> int:
+            """Fills `slot` from the time stretcher, feeding it the 
+            track until it has output. Back at normal speed, the input 
+            it holds is played unstretched before the track is read 
+            directly again"""
+            stretcher = self.stretcher
+
+            while not stretcher.pending():
+                if self.speed == 1:
+                    stretcher.finish()
+                    if not stretcher.pending():
+                        return self.render_direct(slot)
+                    
+                    break
+
+                if stretcher.process(self.speed):
+                    continue
+
+                frames = self.read_track(self.stretch_buffer)
+                if frames == 0:
+                    stretcher.finish()
+                    break
+
+                stretcher.write(self.stretch_buffer[:frames], 
+                                self.render_position, 
+                                self.item)
+                self.render_position += frames
+
+            frames, position, item, rate = stretcher.read_into(slot)
+            if frames > 0:
+                self.commit(slot, frames, position, item, rate)
+                
+            return frames
+        
+
+        def commit(self, 
+                   slot: np.ndarray, 
+                   frames: int, 
+                   position: int, 
+                   item: int, 
+                   rate: float = 1) -> None:
+            """Equalizes a rendered block and publishes it"""
+            self.equalizer.process(slot[:frames])
+            self.ring.commit(frames, position, item, self.generation, rate)
+
+
+        def render_next(self) -> bool:
+            """Continues rendering with the next track of the play queue
+            once the current one ended, so that it starts on the sample
+            after the last one. Only preloaded tracks are used, 
+            otherwise `update` loads the next track as usual"""
+            if (not self.gapless 
+                or self.switch is not None
+                or not self.track.ended(self.render_position)):
+                return False
+            
+            return self.switch_next(close_previous=True)
+        
+
+        def switch_next(self, close_previous: bool) -> bool:
+            """Starts rendering the next track of the play queue if it 
+            is preloaded, the previous track is closed once the switch
+            is heard if `close_previous`"""
+            index = self._PlayQueue.next_index()
+            if index is None:
+                return False
+            
+            path = self._PlayQueue.path_at(index)
+            if path is None or path not in self.preload_cache:
+                return False
+            
+            preloaded = self.preload_cache.get(path)
+            if preloaded is None:
+                return False
+            
+            self.item += 1
+            self.switch = (self.item, path, index, 
+                           self.track if close_previous else None)
+
+            self.track = ArrayTrack(*preloaded)
+            self.render_position = 0
+
+            return True
+        
+
+        def start_fade(self) -> None:
+            """Starts fading into the next track once the current 
+            one is within the crossfade of its end"""
+            if (self.crossfade <= 0 
+                or self.fading is not None 
+                or self.switch is not None):
+                return
+            
+            remaining = self.track.frames - self.render_position
+            if not 0 < remaining <= int(self.crossfade * self.fs):
+                return
+            
+            previous = self.track
+            position = self.render_position
+            if not self.switch_next(close_previous=False):
+                return
+            
+            self.fading = previous
+            self.fade_position = position
+
+            # computed once per fade, the blocks only slice them
+            progress = np.linspace(0, 1, remaining, endpoint=False)
+            if self.crossfade_curve == "linear":
+                fade_in = progress
+                fade_out = 1 - progress
+            else:
+                fade_in = np.sin(progress * np.pi / 2)
+                fade_out = np.cos(progress * np.pi / 2)
+
+            self.fade_in = fade_in.astype(self.dtype)[:, np.newaxis]
+            self.fade_out = fade_out.astype(self.dtype)[:, np.newaxis]
+            self.fade_done = 0
 
-            if self.playing:
-                outdata[:chunk.shape[0]] = chunk * self.volume
-                self.timestamp += frames
+
+        def mix_fade(self, block: np.ndarray, frames: int) -> int:
+            """Mixes the fading track into the `frames` frames of 
+            the next track in `block`, returns the frames mixed"""
+            tail = self.fade_buffer
+            tail_frames = self.fading.read_into(tail, self.fade_position)
+            self.fade_position += tail_frames
+
+            mixed = max(frames, tail_frames)
+            block[frames:mixed] = 0
+            tail[tail_frames:mixed] = 0
+
+            start = self.fade_done
+            end = min(start + mixed, self.fade_in.shape[0])
+            fade = end - start
+
+            np.multiply(block[:fade], self.fade_in[start:end], 
+                        out=block[:fade])
+            np.multiply(tail[:fade], self.fade_out[start:end], 
+                        out=tail[:fade])
+            np.add(block[:fade], tail[:fade], out=block[:fade])
+
+            self.fade_done = end
+            if self.fade_done >= self.fade_in.shape[0]:
+                self.end_fade()
+
+            return mixed
+        
+
+        def end_fade(self) -> None:
+            if self.fading is not None:
+                self.fading.close()
+                self.fading = None
+        
+
+        def finish_switch(self) -> None:
+            """Updates the play queue and the player once the first 
+            block of a gapless switch is played"""
+            with self.track_lock:
+                switch = self.switch
+                if switch is None or self.ring.item != switch[0]:
+                    return
+                
+                self.switch = None
+
+            item, path, index, previous = switch
+            if previous is not None:
+                previous.close()
+
+            self.current_path = path
+            self._PlayQueue.index = index
+            self.clear_failure(path)
+
+            preloaded = self.preload_cache.get(path)
+            if preloaded is not None:
+                self.store_played(path, *preloaded)
+            self.do_default_volume(path)
+
+            self.notify_preloader()
+
+
+        def set_stream_state(self, state: str) -> None:
+            with self.stream_lock:
+                self.stream_state = state
+
+            self.render_wake.set()
 
 
         def thread_stream(self) -> None:
-            with sd.OutputStream(
-                samplerate=self.fs, 
-                channels=self.audio_data.shape[1],
-                callback=self.stream_callback,
-                blocksize=self.blocksize) as stream:
+            try:
+                with sd.OutputStream(
+                    samplerate=self.fs, 
+                    channels=self.channels,
+                    dtype=self.dtype,
+                    callback=self.stream_callback,
+                    blocksize=self.blocksize) as stream:
+
+                    with self.stream_lock:
+                        # unless it was stopped while starting
+                        if self.stream_state == "starting":
+                            self.stream_state = "running"
+
+                    self.render_wake.set()
+                    self.stream_stop.wait()
 
-                while not self.terminate:
-                    time.sleep(0.01)
+            except sd.PortAudioError as error:
+                self.stream_error = error
 
-                self.terminate = False
+            finally:
+                self.set_stream_state("idle")
 
 
         def start_stream(self) -> None:
-            self.thread = threading.Thread(
-                target=self.thread_stream,
-                daemon=True)
-            
-            self.thread.start()
+            if not self.renderer.is_alive():
+                self.renderer.start()
 
+            with self.stream_lock:
+                if self.stream_state == "stopping":
+                    stopping = self.thread
+                else:
+                    stopping = None
 
-        def stop_stream(self) -> None:
-            if self.thread.is_alive():
-                self.terminate = True
-                while self.terminate and self.thread.is_alive():
-                    pass
-                self.terminate = False
+            if stopping is not None:
+                # waits for the previous stream to close first
+                stopping.join(self.stop_timeout)
+
+            with self.stream_lock:
+                if self.stream_state != "idle":
+                    return
+                
+                self.stream_state = "starting"
+                self.stream_error = None
+                self.stream_stop.clear()
+
+                self.thread = threading.Thread(
+                    target=self.thread_stream,
+                    daemon=True)
+                self.thread.start()
+
+
+        def stop_stream(self, wait: bool = True) -> None:
+            """Closes the output stream, waits up to `stop_timeout` 
+            for it to close if `wait`"""
+            with self.stream_lock:
+                if self.stream_state in ["idle", "stopping"]:
+                    thread = None
+                else:
+                    self.stream_state = "stopping"
+                    self.stream_stop.set()
+                    thread = self.thread
+
+            if wait and thread is not None:
+                thread.join(self.stop_timeout)
 
 
         def update(self) -> None:
             if not self.preloader.is_alive():
                 self.preloader.start()
 
-            if self.audio_data.shape[0] <= self.timestamp:
+            self.finish_switch()
+
+            if self.track_ended():
                 if self.playing:
                     self._PlayQueue.play_next()
 
-            if len(self._PlayQueue.play_queue) == 0:
-                self.stop_stream()
+            if (len(self._PlayQueue.play_queue) == 0
+                and (self.current_path or self.track.frames > 0)):
+                # cleared once, a new track every call would keep
+                # the render thread busy while idle
                 self.current_path = ""
-                self.audio_data = np.array([])
+                self.clear_track()
 
                 self._PlayQueue.index = -1 
                 # so that it starts from the start, not the second
@@ -412,6 +1311,22 @@ class Backend:
             self.file_dirs: list[str] = []
             self.file_paths: list[str] = []
 
+            self.extract_cache = ExtractCache(
+                os.path.join(self_path, "data", "extracted"))
+            self.extract_wake = threading.Event()
+            self.extractor = threading.Thread(
+                target=self.extract_loop,
+                daemon=True)
+            
+            # integrated loudness and true peak of every file, 
+            # measured one file at a time in a worker process
+            self.loudness_cache = LoudnessCache(
+                os.path.join(self_path, "data", "loudness.json"))
+            self.analyze_wake = threading.Event()
+            self.analyzer = threading.Thread(
+                target=self.analyze_loop,
+                daemon=True)
+
             self.load_file_dirs()
             self.load_files()
 
@@ -462,6 +1377,85 @@ class Backend:
                         if entry.is_file() and ext.lower() in valid_ext:
                             self.file_paths.append(entry.path)
 
+            self.extract_wake.set()
+            self.analyze_wake.set()
+
+
+        def is_video(self, path: str) -> bool:
+            root, ext = os.path.splitext(path)
+            return ext.lower() in video_ext
+
+
+        def extract_loop(self) -> None:
+            while True:
+                self.extract_wake.wait()
+                self.extract_wake.clear()
+
+                for path in self.file_paths.copy():
+                    if (self.is_video(path) 
+                        and self.extract_cache.lookup(path) is None):
+                        self.extract_cache.add(path, extract_audio)
+
+
+        def analyze_loop(self) -> None:
+            pool = ProcessPoolExecutor(max_workers=1, 
+                                       mp_context=mp_context)
+
+            while True:
+                self.analyze_wake.wait()
+                self.analyze_wake.clear()
+
+                for path in self.file_paths.copy():
+                    if self.loudness_cache.analyzed(path):
+                        continue
+
+                    try:
+                        mtime = os.stat(path).st_mtime_ns
+                    except OSError:
+                        continue
+
+                    try:
+                        future = pool.submit(analyze_file, 
+                                             self.resolve(path))
+                    except RuntimeError:
+                        # shut down by concurrent.futures 
+                        # as the interpreter exits
+                        return
+
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # the worker died on this file, it isn't 
+                        # retried until the file changes
+                        pool = ProcessPoolExecutor(
+                            max_workers=1, mp_context=mp_context)
+                        result = None
+                    except Exception:
+                        result = None
+                    
+                    self.loudness_cache.record(path, mtime, result)
+
+                    if path == self._AudioPlayer.current_path:
+                        self._AudioPlayer.do_default_volume(path)
+
+
+        def resolve(self, path: str) -> str:
+            """Path of the file to decode when playing `path`"""
+            if self.is_video(path):
+                extracted = self.extract_cache.extracted_path(path)
+                if extracted is not None:
+                    return extracted
+                
+            return path
+        
+
+        def update(self) -> None:
+            if not self.extractor.is_alive():
+                self.extractor.start()
+
+            if self.analyzer.ident is None:
+                self.analyzer.start()
+
         
     class PlaylistsControl(BackendClasses):
 
@@ -0,0 +1,566 @@
+import numpy as np
+import threading
+import tempfile
+import hashlib
+import time
+import os
+import json
+from collections import OrderedDict
+from typing import Callable
+
+
+
+# decoding these is already as cheap as reading the cache
+uncompressed_ext = [".wav", ".aiff", ".pcm"]
+
+
+
+def file_key(path: str) -> str | None:
+    """Key that changes whenever the file at `path` changes"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    
+    path = os.path.abspath(path)
+    return f"{path}|{stat.st_mtime_ns}|{stat.st_size}"
+
+
+
+class PCMCache:
+    """Decoded audio stored on disk, evicting the least recently
+    used tracks when the cache grows larger than `max_bytes`"""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.index_path = os.path.join(directory, "index.json")
+        self.entries: dict[str, dict] = {}
+
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+
+    class Writer:
+        """Writes a track to the cache block by block"""
+
+        def __init__(self, 
+                     cache: "PCMCache", 
+                     key: str, 
+                     fs: int, 
+                     channels: int) -> None:
+            
+            self.cache = cache
+            self.key = key
+            self.fs = fs
+            self.channels = channels
+
+            self.frames = 0
+            self.dtype = ""
+
+            fd, self.tmp_path = tempfile.mkstemp(
+                suffix=".tmp", dir=cache.directory)
+            self.file = os.fdopen(fd, "wb")
+
+
+        def write(self, block: np.ndarray) -> None:
+            self.dtype = block.dtype.str
+            self.frames += block.shape[0]
+            self.file.write(np.ascontiguousarray(block).tobytes())
+
+
+        def commit(self) -> None:
+            self.file.close()
+            if self.frames == 0:
+                os.remove(self.tmp_path)
+                return
+            
+            os.replace(self.tmp_path, self.cache.file_path(self.key))
+            self.cache.add_entry(self.key, {
+                "fs": self.fs,
+                "channels": self.channels,
+                "frames": self.frames,
+                "dtype": self.dtype,
+                "bytes": os.path.getsize(self.cache.file_path(self.key)),
+                "last_used": time.time()})
+
+
+        def abort(self) -> None:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+
+    def load_index(self) -> None:
+        try:
+            with open(self.index_path, "r") as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+        # drop entries whose data file went missing
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if os.path.exists(self.file_path(key))}
+        
+        # left behind by writes that were interrupted
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+    def save_index(self) -> None:
+        with open(self.index_path, "w") as file:
+            json.dump(self.entries, file)
+
+
+    def file_path(self, key: str) -> str:
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, name + ".pcm")
+    
+
+    def cacheable(self, path: str) -> bool:
+        root, ext = os.path.splitext(path)
+        return ext.lower() not in uncompressed_ext
+
+
+    def open(self, 
+             path: str, 
+             dtype: str = "float32"
+             ) -> tuple[np.ndarray, int] | None:
+        """Returns the cached audio of `path` as a read only memmap"""
+        key = file_key(path)
+        
+        with self.lock:
+            if key not in self.entries:
+                return None
+            
+            entry = self.entries[key]
+            if entry["dtype"] != np.dtype(dtype).str:
+                # decoded for another pipeline dtype, 
+                # it is replaced when the file is decoded again
+                return None
+            
+            entry["last_used"] = time.time()
+            self.save_index()
+
+        try:
+            data = np.memmap(self.file_path(key),
+                             dtype=np.dtype(entry["dtype"]),
+                             mode="r",
+                             shape=(entry["frames"], entry["channels"]))
+        except OSError:
+            return None
+        
+        return data, entry["fs"]
+
+
+    def writer(self, 
+               path: str, 
+               fs: int, 
+               channels: int) -> "PCMCache.Writer | None":
+        
+        key = file_key(path)
+        if key is None or not self.cacheable(path):
+            return None
+        
+        return self.Writer(self, key, fs, channels)
+
+
+    def store(self, path: str, data: np.ndarray, fs: int) -> None:
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+
+        writer = self.writer(path, fs, data.shape[1])
+        if writer is not None:
+            writer.write(data)
+            writer.commit()
+
+
+    def add_entry(self, key: str, entry: dict) -> None:
+        with self.lock:
+            self.entries[key] = entry
+            self.evict()
+            self.save_index()
+
+
+    def evict(self) -> None:
+        total = sum(entry["bytes"] for entry in self.entries.values())
+
+        for key in sorted(self.entries, 
+                          key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                return
+
+            try:
+                os.remove(self.file_path(key))
+            except OSError:
+                # still memory mapped by a playing track
+                continue
+
+            total -= self.entries.pop(key)["bytes"]
+
+
+
+class PreloadCache:
+    """Decoded tracks kept in memory for the play queue, limited to 
+    `max_bytes`. When over the limit, the track furthest from the 
+    current queue index is evicted first, then the least recently 
+    used one"""
+
+    def __init__(self, 
+                 max_bytes: int,
+                 on_evict: Callable[[str], None] | None = None) -> None:
+        
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+
+        # ordered from the least to the most recently used
+        self.entries: OrderedDict[str, tuple[np.ndarray, int]] = (
+            OrderedDict())
+        self.bytes = 0
+
+        # sizes of every track decoded, including the ones that 
+        # didn't fit, so they are not decoded again just to be dropped
+        self.sizes: dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.RLock()
+
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.entries
+    
+
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+
+    def entry_size(self, audio_data: np.ndarray) -> int:
+        if isinstance(audio_data, np.memmap):
+            # backed by the PCM cache file, not by memory
+            return 0
+        
+        return audio_data.nbytes
+    
+
+    def get(self, path: str) -> tuple[np.ndarray, int] | None:
+        with self.lock:
+            if path not in self.entries:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self.entries.move_to_end(path)
+
+            return self.entries[path]
+        
+
+    def fits(self, path: str, distance: Callable[[str], int]) -> bool:
+        """Whether `path` fits in the cache after evicting the tracks
+        further from the queue index than it"""
+        if path not in self.sizes:
+            return True
+        
+        with self.lock:
+            path_distance = distance(path)
+            free = self.max_bytes - self.bytes + sum(
+                self.sizes[key] for key in self.entries 
+                if distance(key) > path_distance)
+            
+        return self.sizes[path] <= free
+    
+
+    def add(self, 
+            path: str, 
+            audio_data: np.ndarray, 
+            fs: int,
+            distance: Callable[[str], int]) -> bool:
+        """Adds a track, returns False if it didn't fit"""
+        with self.lock:
+            if path in self.entries:
+                return True
+            
+            self.sizes[path] = self.entry_size(audio_data)
+            if not self.fits(path, distance):
+                return False
+            
+            self.entries[path] = (audio_data, fs)
+            self.bytes += self.sizes[path]
+
+            self.shrink(distance)
+
+        return True
+    
+
+    def pop(self, path: str) -> None:
+        with self.lock:
+            if path not in self.entries:
+                return
+            
+            self.entries.pop(path)
+            self.bytes -= self.sizes[path]
+
+        if self.on_evict is not None:
+            self.on_evict(path)
+
+
+    def shrink(self, distance: Callable[[str], int]) -> None:
+        with self.lock:
+            while self.bytes > self.max_bytes and len(self.entries) > 0:
+                order = list(self.entries)
+                victim = max(range(len(order)), 
+                             key=lambda i: (distance(order[i]), -i))
+                
+                self.pop(order[victim])
+
+
+    def evict(self, 
+              distance: Callable[[str], int], 
+              max_distance: int) -> None:
+        """Evicts the tracks further than `max_distance` from 
+        the queue index, then shrinks the cache to its limit"""
+        with self.lock:
+            for path in list(self.entries):
+                if distance(path) > max_distance:
+                    self.pop(path)
+
+            self.shrink(distance)
+
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            "tracks": len(self.entries),
+            "bytes": self.bytes}
+
+
+
+class DecoderCache:
+    """Remembers which decoder can read each file, and which files
+    can't be read by any decoder, until the file is modified"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, list] = {}
+
+        self.lock = threading.Lock()
+
+        self.load()
+
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+
+    def save(self) -> None:
+        with open(self.path, "w") as file:
+            json.dump(self.entries, file)
+
+
+    def get(self, path: str) -> str | None:
+        """Name of the decoder that read `path`, "" if none could, 
+        None if it is unknown"""
+        if path not in self.entries:
+            return None
+        
+        mtime, decoder = self.entries[path]
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+        
+        return decoder
+    
+
+    def failed(self, path: str) -> bool:
+        return self.get(path) == ""
+    
+
+    def record(self, path: str, decoder: str) -> None:
+        """Records the decoder that read `path`, "" for a failure"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        
+        with self.lock:
+            if self.entries.get(path) == [mtime, decoder]:
+                return
+            
+            self.entries[path] = [mtime, decoder]
+            self.save()
+
+
+
+class ExtractCache:
+    """Audio streams of video files copied into FLAC files,
+    so that playing them doesn't demux the whole container"""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+
+        # path -> [file key, FLAC file name or "" if it has no audio]
+        self.entries: dict[str, list[str]] = {}
+
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+
+    def load_index(self) -> None:
+        try:
+            with open(self.index_path, "r") as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+
+    def save_index(self) -> None:
+        with open(self.index_path, "w") as file:
+            json.dump(self.entries, file)
+
+
+    def lookup(self, path: str) -> str | None:
+        """Returns "" if `path` was found to have no audio stream,
+        None if it wasn't extracted since it last changed"""
+        if path not in self.entries:
+            return None
+        
+        key, name = self.entries[path]
+        if key != file_key(path):
+            return None
+        
+        if name == "":
+            return ""
+        
+        return os.path.join(self.directory, name)
+    
+
+    def extracted_path(self, path: str) -> str | None:
+        extracted = self.lookup(path)
+        if extracted:
+            return extracted
+        
+        return None
+    
+
+    def add(self, 
+            path: str, 
+            extract: Callable[[str, str], bool | None]) -> None:
+        """`extract` returns whether the file has an audio stream, 
+        or None if that couldn't be found out, which isn't recorded
+        so that it is tried again"""
+        key = file_key(path)
+        if key is None:
+            return
+        
+        name = hashlib.sha1(key.encode()).hexdigest() + ".flac"
+        output_path = os.path.join(self.directory, name)
+        tmp_path = output_path + ".tmp"
+
+        extracted = extract(path, tmp_path)
+
+        if extracted:
+            os.replace(tmp_path, output_path)
+        else:
+            name = ""
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if extracted is None:
+            return
+
+        with self.lock:
+            if path in self.entries and self.entries[path][1] != name:
+                # extracted from an older version of the file
+                self.remove_file(self.entries[path][1])
+
+            self.entries[path] = [key, name]
+            self.save_index()
+
+
+    def remove_file(self, name: str) -> None:
+        if name == "":
+            return
+        
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+
+
+class LoudnessCache:
+    """Loudness analysis of each file, until the file is modified"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        # path -> [mtime, {"loudness": LUFS, "peak": dBTP} or None
+        # if the file couldn't be decoded]
+        self.entries: dict[str, list] = {}
+
+        self.lock = threading.Lock()
+
+        self.load()
+
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+
+    def save(self) -> None:
+        with open(self.path, "w") as file:
+            json.dump(self.entries, file)
+
+
+    def analyzed(self, path: str) -> bool:
+        """Whether `path` was analyzed since it last changed"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        
+        try:
+            return os.stat(path).st_mtime_ns == entry[0]
+        except OSError:
+            return False
+    
+
+    def get(self, path: str) -> dict[str, float | None] | None:
+        if not self.analyzed(path):
+            return None
+        
+        return self.entries[path][1]
+    
+
+    def record(self, 
+               path: str, 
+               mtime: int, 
+               result: dict[str, float | None] | None) -> None:
+        
+        with self.lock:
+            self.entries[path] = [mtime, result]
+            self.save()
@@ -0,0 +1,541 @@
+import numpy as np
+import soundfile as sf
+from multiprocessing.shared_memory import SharedMemory
+import subprocess
+import shutil
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Callable, Any
+
+from _resample import Resampler, remix, convert
+
+try:
+    # the ffmpeg binary bundled with moviepy's dependencies, imported
+    # here so that worker processes aren't forked while a thread holds
+    # its import lock
+    import imageio_ffmpeg
+except ImportError:
+    imageio_ffmpeg = None
+
+
+# number of channels of the channel layouts printed by ffmpeg
+ffmpeg_layouts = {
+    "mono": 1, "stereo": 2, "2.1": 3, "3.0": 3, "quad": 4, "4.0": 4,
+    "4.1": 5, "5.0": 5, "5.1": 6, "6.0": 6, "6.1": 7, "7.0": 7, 
+    "7.1": 8, "downmix": 2
+}
+
+# formats that libsndfile is likely to read
+sndfile_ext = [".wav", ".flac", ".ogg", ".aiff", ".mp3", ".opus"]
+
+# ffmpeg raw output formats of the supported sample dtypes
+ffmpeg_formats = {"float32": ("f32le", "<f4"), "float64": ("f64le", "<f8")}
+
+
+
+class DecodeError(Exception):
+    pass
+
+
+
+class DecodeCancelled(Exception):
+    pass
+
+
+
+class Decoder(ABC):
+    """Reads the audio of a file block by block"""
+
+    def __init__(self, path: str, dtype: str = "float32") -> None:
+        self.path = path
+        self.dtype = dtype
+        self.fs = 44100
+        self.channels = 2
+        self.frames = 0
+
+        # whether seek() lands exactly on the frame 
+        # and `frames` is the exact length of the file
+        self.seekable = False
+
+
+    @abstractmethod
+    def read(self, frames: int) -> np.ndarray:
+        """Returns up to `frames` frames as a 2D array, 
+        an empty array means the end of the file"""
+
+
+    @abstractmethod
+    def seek(self, frame: int) -> None:
+        pass
+
+
+    def close(self) -> None:
+        pass
+
+
+    def convert(self, fs: int, channels: int) -> "Decoder":
+        """Returns a decoder of the same audio at `fs` 
+        with `channels` channels"""
+        if fs == self.fs and channels == self.channels:
+            return self
+        
+        return ConvertedDecoder(self, fs, channels)
+
+
+    def read_all(self, 
+                 blocksize: int = 65536,
+                 cancelled: Callable[[], bool] | None = None
+                 ) -> np.ndarray:
+        """Decodes the rest of the file into one array, 
+        `cancelled` is checked between blocks"""
+        data = np.empty((max(self.frames, blocksize), self.channels),
+                        dtype=self.dtype)
+        filled = 0
+
+        while True:
+            if cancelled is not None and cancelled():
+                raise DecodeCancelled(self.path)
+            
+            block = self.read(blocksize)
+            frames = block.shape[0]
+            if frames == 0:
+                break
+
+            if filled + frames > data.shape[0]:
+                # the frame count of some formats is only an estimate
+                grown = np.empty((int((filled + frames) * 1.5), 
+                                  self.channels), dtype=self.dtype)
+                grown[:filled] = data[:filled]
+                data = grown
+
+            data[filled:filled + frames] = block
+            filled += frames
+
+        return data[:filled]
+
+
+
+class SndfileDecoder(Decoder):
+
+    def __init__(self, path: str, dtype: str = "float32") -> None:
+        super().__init__(path, dtype)
+
+        self.file = sf.SoundFile(path)
+        self.fs = self.file.samplerate
+        self.channels = self.file.channels
+        self.frames = self.file.frames
+        self.seekable = self.file.seekable()
+
+
+    def read(self, frames: int) -> np.ndarray:
+        return self.file.read(frames, dtype=self.dtype, always_2d=True)
+
+
+    def seek(self, frame: int) -> None:
+        self.file.seek(frame)
+
+
+    def close(self) -> None:
+        self.file.close()
+
+
+
+class FFmpegDecoder(Decoder):
+    """Decodes only the audio stream of a file by piping raw samples
+    out of the ffmpeg binary, used for video containers and other 
+    formats libsndfile can't read"""
+
+    def __init__(self, path: str, dtype: str = "float32") -> None:
+        super().__init__(path, dtype)
+
+        self.binary = find_ffmpeg()
+        if self.binary is None:
+            raise DecodeError("ffmpeg binary not found")
+        
+        self.popen_params = ffmpeg_popen_params()
+
+        self.probe()
+
+        self.format, sample_dtype = ffmpeg_formats.get(
+            dtype, ffmpeg_formats["float32"])
+        self.sample_dtype = np.dtype(sample_dtype)
+        self.frame_bytes = self.channels * self.sample_dtype.itemsize
+
+        self.process: subprocess.Popen | None = None
+        self.open_pipe(0)
+
+
+    def probe(self) -> None:
+        result = subprocess.run(
+            [self.binary, "-hide_banner", "-i", self.path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            **self.popen_params)
+        
+        info = result.stderr.decode(errors="ignore")
+
+        match = re.search(r"Stream #.*?Audio: .*?(\d+) Hz, ([^,\n]+)", 
+                          info)
+        if match is None:
+            raise DecodeError(f"no audio stream in {self.path}")
+        
+        self.fs = int(match.group(1))
+
+        layout = match.group(2).split("(")[0].strip()
+        if layout in ffmpeg_layouts:
+            self.channels = ffmpeg_layouts[layout]
+        elif layout.split(" ")[0].isdigit():
+            self.channels = int(layout.split(" ")[0]) # "N channels"
+        else:
+            self.channels = 2
+
+        match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", info)
+        if match is not None:
+            hours, minutes, seconds = match.groups()
+            duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            self.frames = int(duration * self.fs)
+
+
+    def open_pipe(self, frame: int) -> None:
+        self.close()
+
+        command = [self.binary, "-v", "error", "-nostdin"]
+        if frame > 0:
+            command += ["-ss", f"{frame / self.fs:.6f}"]
+
+        command += [
+            "-i", self.path,
+            "-vn", "-sn", "-dn",
+            "-f", self.format,
+            "-acodec", "pcm_" + self.format,
+            "-ac", str(self.channels),
+            "-ar", str(self.fs),
+            "-"]
+        
+        self.process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            bufsize=self.fs * self.frame_bytes,
+            **self.popen_params)
+
+
+    def read(self, frames: int) -> np.ndarray:
+        if self.process is None or self.process.stdout is None:
+            return np.zeros((0, self.channels), dtype=self.dtype)
+        
+        raw = self.process.stdout.read(frames * self.frame_bytes)
+        frames = len(raw) // self.frame_bytes
+
+        block = np.frombuffer(raw, dtype=self.sample_dtype,
+                              count=frames * self.channels)
+        
+        return block.reshape(frames, self.channels).astype(
+            self.dtype, copy=False)
+
+
+    def seek(self, frame: int) -> None:
+        self.open_pipe(frame)
+
+
+    def convert(self, fs: int, channels: int) -> Decoder:
+        if fs != self.fs:
+            # resampled by ffmpeg itself
+            self.frames = self.frames * fs // self.fs
+            self.fs = fs
+            self.open_pipe(0)
+
+        return super().convert(fs, channels)
+
+
+    def close(self) -> None:
+        if self.process is not None:
+            self.process.kill()
+            if self.process.stdout is not None:
+                self.process.stdout.close()
+            self.process.wait()
+
+            self.process = None
+
+
+
+class ConvertedDecoder(Decoder):
+    """Converts the output of another decoder 
+    to a sample rate and a number of channels"""
+
+    def __init__(self, decoder: Decoder, fs: int, channels: int) -> None:
+        super().__init__(decoder.path, decoder.dtype)
+
+        self.decoder = decoder
+        self.fs = fs
+        self.channels = channels
+        self.seekable = decoder.seekable
+
+        self.resampler: Resampler | None = None
+        if decoder.fs != fs:
+            self.resampler = Resampler(decoder.fs, fs, channels, self.dtype)
+            self.frames = self.resampler.output_frames(decoder.frames)
+        else:
+            self.frames = decoder.frames
+
+        # converted frames that didn't fit in the last read
+        self.pending = np.zeros((0, channels), dtype=self.dtype)
+        self.finished = False
+
+
+    def read(self, frames: int) -> np.ndarray:
+        blocks = [self.pending]
+        filled = self.pending.shape[0]
+
+        while filled < frames and not self.finished:
+            block = self.decoder.read(
+                -(-frames * self.decoder.fs // self.fs))
+            self.finished = block.shape[0] == 0
+
+            block = remix(block, self.channels)
+            if self.resampler is not None:
+                block = self.resampler.process(block, self.finished)
+
+            blocks.append(block)
+            filled += block.shape[0]
+
+        block = np.concatenate(blocks)
+        self.pending = block[frames:]
+
+        return block[:frames]
+
+
+    def seek(self, frame: int) -> None:
+        self.pending = self.pending[:0]
+        self.finished = False
+
+        if self.resampler is None:
+            self.decoder.seek(frame)
+        else:
+            self.decoder.seek(self.resampler.reset(frame))
+
+
+    def close(self) -> None:
+        self.decoder.close()
+
+
+
+def ffmpeg_popen_params() -> dict:
+    params = {}
+    if os.name == "nt":
+        # CREATE_NO_WINDOW, don't flash a console on Windows
+        params["creationflags"] = 0x08000000
+
+    return params
+
+
+def extract_audio(path: str, output_path: str) -> bool | None:
+    """Copies the first audio stream of `path` into a FLAC file,
+    returns whether it had one, or None if ffmpeg couldn't tell"""
+    binary = find_ffmpeg()
+    if binary is None:
+        return None
+    
+    command = [
+        binary, "-v", "error", "-nostdin", "-y",
+        "-i", path,
+        "-map", "0:a:0",
+        "-vn", "-sn", "-dn",
+        "-c:a", "flac",
+        "-sample_fmt", "s32",
+        "-f", "flac",
+        output_path]
+    
+    result = subprocess.run(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        **ffmpeg_popen_params())
+    
+    if result.returncode == 0:
+        return True
+    
+    if b"matches no streams" in result.stderr:
+        return False
+    
+    return None
+
+
+def find_ffmpeg() -> str | None:
+    binary = shutil.which("ffmpeg")
+    if binary is not None:
+        return binary
+    
+    if imageio_ffmpeg is None:
+        return None
+    
+    try:
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except RuntimeError:
+        return None
+    
+
+def decoder_order(path: str, known: str | None = None) -> list[str]:
+    """Order to try the decoders in, the decoder that worked before 
+    first, otherwise a guess based on the extension"""
+    root, ext = os.path.splitext(path)
+
+    if ext.lower() in sndfile_ext:
+        order = ["sndfile", "ffmpeg", "moviepy"]
+    else:
+        order = ["ffmpeg", "sndfile", "moviepy"]
+
+    if known in order:
+        order.remove(known)
+        order.insert(0, known)
+
+    return order
+    
+
+def open_decoder(path: str, 
+                 dtype: str = "float32",
+                 order: list[str] | None = None
+                 ) -> tuple[Decoder, str]:
+    """Opens the first decoder in `order` that can read `path`, 
+    returns it along with its name"""
+    if order is None:
+        order = decoder_order(path)
+
+    for name in order:
+        try:
+            if name == "sndfile":
+                return SndfileDecoder(path, dtype), name
+            if name == "ffmpeg":
+                return FFmpegDecoder(path, dtype), name
+        except (sf.LibsndfileError, DecodeError):
+            continue
+        
+    raise DecodeError(f"no decoder can read {path}")
+
+
+def decode_moviepy(path: str, 
+                   dtype: str = "float32"
+                   ) -> tuple[np.ndarray, int] | None:
+    
+    # slow to import, only needed when ffmpeg can't be found
+    from moviepy.editor import VideoFileClip
+
+    try:
+        audio = VideoFileClip(path).audio
+        if audio is not None:
+            audio_data = audio.to_soundarray().astype(dtype, copy=False)
+            return audio_data, audio.fps
+    except (KeyError, OSError):
+        pass
+
+    return None
+
+
+def decode_file(path: str, 
+                dtype: str = "float32",
+                order: list[str] | None = None,
+                cancelled: Callable[[], bool] | None = None,
+                fs: int | None = None,
+                channels: int | None = None
+                ) -> tuple[np.ndarray, int, str] | None:
+    """Decodes a whole file with the first decoder in `order` that
+    can read it, returns the audio, its sample rate and the name of
+    the decoder, or None if it can't be decoded. 
+    The audio is converted to `fs` and `channels` if they are given.
+    Raises DecodeCancelled once `cancelled` returns True"""
+    if order is None:
+        order = decoder_order(path)
+
+    for name in order:
+        if name in ["sndfile", "ffmpeg"]:
+            try:
+                decoder, name = open_decoder(path, dtype, [name])
+            except DecodeError:
+                continue
+
+            if fs is not None and channels is not None:
+                decoder = decoder.convert(fs, channels)
+
+            try:
+                audio_data = decoder.read_all(cancelled=cancelled)
+            finally:
+                decoder.close()
+
+            if audio_data.shape[0] > 0:
+                return audio_data, decoder.fs, name
+        
+        # moviepy uses the same ffmpeg binary, 
+        # it is only worth trying when the binary isn't found
+        if name == "moviepy" and find_ffmpeg() is None:
+            result = decode_moviepy(path, dtype)
+            if result is None:
+                continue
+
+            audio_data, audio_fs = result
+            if fs is not None and channels is not None:
+                audio_data = convert(audio_data, audio_fs, fs, channels)
+                audio_fs = fs
+
+            return audio_data, audio_fs, name
+
+    return None
+
+
+
+def decode_shared(path: str, 
+                  blocks: Any,
+                  dtype: str = "float32",
+                  order: list[str] | None = None,
+                  cancel_flag: str | None = None,
+                  fs: int | None = None,
+                  channels: int | None = None
+                  ) -> tuple[str, tuple[int, int], int, str] | None:
+    """Decodes a whole file into a new shared memory block, 
+    runs in the preloader's worker processes so that the decoded 
+    audio does not have to be pickled back to the player.
+    The block is created by `blocks`, a proxy of the scheduler's 
+    SharedBlocks, which keeps it open after this process lets go.
+    Returns the name of the block, the shape of the audio, 
+    its sample rate and the name of the decoder used.
+    The decode stops when the first byte of the `cancel_flag` 
+    shared memory block is set"""
+    flag = None
+    cancelled = None
+    if cancel_flag is not None:
+        flag = SharedMemory(name=cancel_flag)
+        cancelled = lambda: flag.buf[0] != 0
+
+    try:
+        result = decode_file(path, dtype, order, cancelled, fs, channels)
+    except DecodeCancelled:
+        return None
+    finally:
+        if flag is not None:
+            flag.close()
+
+    if result is None:
+        return None
+    
+    audio_data, fs, decoder = result
+    if audio_data.ndim == 1:
+        audio_data = audio_data[:, np.newaxis]
+
+    if audio_data.shape[0] == 0:
+        return None
+    
+    name = blocks.create(audio_data.nbytes)
+
+    shm = SharedMemory(name=name)
+    shared = np.ndarray(audio_data.shape, 
+                        dtype=audio_data.dtype, 
+                        buffer=shm.buf)
+    shared[:] = audio_data
+
+    del shared
+    shm.close()
+
+    return name, audio_data.shape, fs, decoder
@@ -0,0 +1,171 @@
+import numpy as np
+import functools
+
+
+
+# centre frequencies of the bands, an octave apart
+bands = (31.25, 62.5, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+max_gain = 12
+
+# gains of each band in dB
+presets = {
+    "flat": (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+    "bass boost": (6, 5, 4, 2, 0, 0, 0, 0, 0, 0),
+    "treble boost": (0, 0, 0, 0, 0, 0, 2, 4, 5, 6),
+    "vocal": (-3, -2, -1, 1, 3, 4, 3, 1, 0, -1),
+    "rock": (5, 4, 2, -1, -2, -1, 2, 3, 4, 4),
+    "pop": (-1, 1, 3, 4, 3, 0, -1, -1, 1, 2),
+    "classical": (0, 0, 0, 0, 0, 0, -2, -3, -3, -4),
+    "loudness": (6, 4, 1, 0, -1, 0, 0, 1, 4, 5),
+}
+
+
+
+def filter_sizes(fs: int, blocksize: int) -> tuple[int, int]:
+    """Taps of the filter, 50 ms so that the lowest band is resolved,
+    and the FFT size that convolves a block with it"""
+    taps = int(fs * 0.05)
+    fft_size = 1 << (blocksize + taps - 2).bit_length()
+
+    return taps, fft_size
+
+
+@functools.lru_cache
+def band_weights(fs: int, size: int) -> np.ndarray:
+    """(frequency bins, bands) weights of each band's gain at the bins
+    of an FFT of `size`, interpolated over log frequency and flat
+    beyond the outer bands"""
+    frequencies = np.fft.rfftfreq(size, 1 / fs)
+    frequencies[0] = frequencies[1]
+
+    octaves = np.log2(frequencies)
+    weights = np.stack([
+        np.interp(octaves, np.log2(bands), np.eye(len(bands))[band])
+        for band in range(len(bands))], axis=1)
+
+    weights.setflags(write=False)
+    return weights
+
+
+@functools.lru_cache(maxsize=32)
+def filter_response(fs: int,
+                    blocksize: int,
+                    gains: tuple[float, ...]) -> np.ndarray:
+    """Spectrum of the minimum phase filter for `gains`, which delays
+    the audio by about as little as an analog equalizer would. 
+    It is lowered by the largest boost, so that boosted bands 
+    don't raise the peak level"""
+    taps, fft_size = filter_sizes(fs, blocksize)
+
+    # designed on a finer grid than it is used at, so that
+    # truncating it to `taps` changes little
+    size = 8 * fft_size
+    log_magnitude = (band_weights(fs, size) @ np.array(gains, dtype=float)
+                     * np.log(10) / 20)
+
+    # minimum phase from the folded real cepstrum
+    cepstrum = np.fft.irfft(log_magnitude, size)
+    fold = np.zeros(size)
+    fold[0] = 1
+    fold[1:size // 2] = 2
+    fold[size // 2] = 1
+
+    impulse = np.fft.irfft(np.exp(np.fft.rfft(cepstrum * fold)), size)
+    impulse *= 10 ** (-max(0, max(gains)) / 20)
+
+    # faded out over its last quarter
+    fade = taps // 4
+    impulse = impulse[:taps]
+    impulse[-fade:] *= np.hanning(2 * fade)[fade:]
+
+    response = np.fft.rfft(impulse, fft_size)[:, np.newaxis]
+    response.setflags(write=False)
+    return response
+
+
+
+class Equalizer:
+    """Graphic equalizer applied to blocks in place, by overlap-add
+    convolution with a filter designed from the band gains"""
+
+    def __init__(self,
+                 fs: int,
+                 channels: int,
+                 blocksize: int,
+                 dtype: str = "float32") -> None:
+
+        self.fs = fs
+        self.blocksize = blocksize
+
+        self.taps, self.fft_size = filter_sizes(fs, blocksize)
+
+        self.gains = presets["flat"]
+        self.response: np.ndarray | None = None
+
+        # set when changed to flat, the next block fades from
+        # the filtered audio to the unfiltered one
+        self.fading = False
+
+        # a block zero padded to the FFT size, and the filtered
+        # output that later blocks still add to
+        self.padded = np.zeros((self.fft_size, channels), dtype=dtype)
+        self.tail = np.zeros((self.fft_size, channels), dtype=dtype)
+        self.dry = np.zeros((blocksize, channels), dtype=dtype)
+
+
+    def set_gains(self, gains: tuple[float, ...]) -> None:
+        if len(gains) != len(bands):
+            raise ValueError(f"expected {len(bands)} band gains")
+
+        self.gains = tuple(float(min(max(gain, -max_gain), max_gain))
+                           for gain in gains)
+
+        if not any(self.gains):
+            # flat is bypassed, so the audio stays bit exact
+            self.fading = self.response is not None
+        else:
+            self.response = filter_response(self.fs,
+                                            self.blocksize,
+                                            self.gains)
+            self.fading = False
+
+
+    def process(self, block: np.ndarray) -> None:
+        if self.response is None:
+            return
+
+        for start in range(0, block.shape[0], self.blocksize):
+            if self.response is None:
+                return
+            
+            self.process_block(block[start:start + self.blocksize])
+
+
+    def process_block(self, block: np.ndarray) -> None:
+        frames = block.shape[0]
+
+        if self.fading:
+            self.dry[:frames] = block
+
+        self.padded[:frames] = block
+        self.padded[frames:] = 0
+
+        spectrum = np.fft.rfft(self.padded, axis=0)
+        spectrum *= self.response
+
+        self.tail += np.fft.irfft(spectrum, self.fft_size, axis=0)
+
+        block[:] = self.tail[:frames]
+
+        self.tail[:-frames] = self.tail[frames:]
+        self.tail[-frames:] = 0
+
+        if self.fading:
+            fade = np.linspace(0, 1, frames, 
+                               dtype=block.dtype)[:, np.newaxis]
+            block += (self.dry[:frames] - block) * fade
+
+            self.response = None
+            self.tail[:] = 0
+            self.fading = False
@@ -0,0 +1,175 @@
+import numpy as np
+import soundfile as sf
+
+from _decoder import DecodeError, open_decoder
+from _resample import Resampler
+
+
+
+# weights of each channel in the sum of the channel powers, by the
+# number of channels in WAV / ffmpeg order, LFE isn't counted
+channel_weights = {
+    4: [1, 1, 1.41, 1.41], # L R Ls Rs
+    5: [1, 1, 1, 1.41, 1.41], # L R C Ls Rs
+    6: [1, 1, 1, 0, 1.41, 1.41], # L R C LFE Ls Rs
+}
+
+# the two stages of the K-weighting filter as (gain in dB, Q, frequency),
+# designed for any sample rate to match the 48 kHz coefficients
+k_shelf = (3.99984385397, 0.7071752369554193, 1681.9744509555319)
+k_highpass = (0.0, 0.5003270373253953, 38.13547087613982)
+
+
+
+def k_weighting(fs: int, frequencies: np.ndarray) -> np.ndarray:
+    """Power response of the BS.1770 K-weighting filter"""
+    gain, q, fc = k_shelf
+    k = np.tan(np.pi * fc / fs)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+
+    shelf_b = [vh + vb * k / q + k ** 2,
+               2 * (k ** 2 - vh),
+               vh - vb * k / q + k ** 2]
+    shelf_a = [1 + k / q + k ** 2,
+               2 * (k ** 2 - 1),
+               1 - k / q + k ** 2]
+
+    gain, q, fc = k_highpass
+    k = np.tan(np.pi * fc / fs)
+
+    highpass_a = [1 + k / q + k ** 2,
+                  2 * (k ** 2 - 1),
+                  1 - k / q + k ** 2]
+    # BS.1770 leaves the numerator as [1, -2, 1] after normalizing
+    highpass_b = [highpass_a[0], -2 * highpass_a[0], highpass_a[0]]
+
+    z = np.exp(-2j * np.pi * frequencies / fs)
+    response = np.ones_like(z)
+
+    for b, a in [(shelf_b, shelf_a), (highpass_b, highpass_a)]:
+        response *= ((b[0] + b[1] * z + b[2] * z ** 2)
+                     / (a[0] + a[1] * z + a[2] * z ** 2))
+
+    return np.abs(response) ** 2
+
+
+
+class LoudnessMeter:
+    """Integrated loudness (EBU R128 / BS.1770) and true peak of
+    audio fed block by block. The K-weighted power of every 100 ms
+    segment is computed in the frequency domain, 400 ms gating
+    blocks are the mean of 4 consecutive segments"""
+
+    def __init__(self, fs: int, channels: int) -> None:
+        self.fs = fs
+        self.channels = channels
+
+        self.segment = fs // 10
+        self.pending = np.zeros((0, channels), dtype="float32")
+
+        frequencies = np.fft.rfftfreq(self.segment, 1 / fs)
+
+        # one-sided spectrum, Parseval's theorem gives the mean square
+        weights = np.full(frequencies.shape[0], 2.0)
+        weights[0] = 1
+        if self.segment % 2 == 0:
+            weights[-1] = 1
+
+        self.weights = (k_weighting(fs, frequencies) * weights
+                        / self.segment ** 2)[:, np.newaxis]
+
+        self.channel_weights = np.array(
+            channel_weights.get(channels, [1] * channels))
+
+        self.powers: list[np.ndarray] = []
+
+        # true peak from 4 times oversampling
+        self.oversampler = Resampler(fs, fs * 4, channels)
+        self.peak = 0.0
+
+
+    def add(self, block: np.ndarray) -> None:
+        self.measure_peak(self.oversampler.process(block))
+
+        self.pending = np.concatenate([self.pending, block])
+
+        segments = self.pending.shape[0] // self.segment
+        if segments == 0:
+            return
+
+        frames = segments * self.segment
+        data = self.pending[:frames].reshape(
+            segments, self.segment, self.channels)
+        self.pending = self.pending[frames:]
+
+        spectrum = np.fft.rfft(data, axis=1)
+        power = np.sum((spectrum.real ** 2 + spectrum.imag ** 2)
+                       * self.weights, axis=1)
+
+        self.powers.append(power @ self.channel_weights)
+
+
+    def measure_peak(self, block: np.ndarray) -> None:
+        if block.shape[0] > 0:
+            self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+
+    def finish(self) -> dict[str, float | None]:
+        """Returns the integrated loudness in LUFS and the true peak
+        in dBTP, each None if the audio is silent"""
+        self.measure_peak(self.oversampler.process(
+            self.pending[:0], final=True))
+
+        peak = float(20 * np.log10(self.peak)) if self.peak > 0 else None
+
+        if not self.powers:
+            return {"loudness": None, "peak": peak}
+
+        segments = np.concatenate(self.powers)
+        if segments.shape[0] < 4:
+            return {"loudness": None, "peak": peak}
+
+        blocks = np.convolve(segments, np.full(4, 0.25), mode="valid")
+
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(blocks)
+
+        gated = blocks[loudness > -70]
+        if gated.shape[0] == 0:
+            return {"loudness": None, "peak": peak}
+
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+
+        gated = blocks[(loudness > -70) & (loudness > relative_gate)]
+        integrated = -0.691 + 10 * np.log10(gated.mean())
+
+        return {"loudness": float(integrated), "peak": peak}
+
+
+
+def analyze_file(path: str,
+                 blocksize: int = 65536) -> dict[str, float | None] | None:
+    """Measures a whole file block by block, runs in the library's
+    analyzer process, None if the file can't be decoded"""
+    try:
+        decoder, name = open_decoder(path, "float32")
+    except DecodeError:
+        return None
+
+    try:
+        meter = LoudnessMeter(decoder.fs, decoder.channels)
+
+        while True:
+            block = decoder.read(blocksize)
+            if block.shape[0] == 0:
+                break
+
+            meter.add(block)
+    except (sf.LibsndfileError, DecodeError):
+        # corrupt past its header
+        return None
+    finally:
+        decoder.close()
+
+    return meter.finish()
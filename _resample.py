@@ -0,0 +1,189 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import functools
+import math
+
+
+
+class Resampler:
+    """Windowed sinc sample rate converter that works block by block,
+    keeping the input that later output frames still need"""
+
+    def __init__(self,
+                 fs_in: int,
+                 fs_out: int,
+                 channels: int,
+                 dtype: str = "float32",
+                 taps: int = 16) -> None:
+
+        divisor = math.gcd(fs_in, fs_out)
+        self.up = fs_out // divisor
+        self.down = fs_in // divisor
+
+        self.channels = channels
+        self.dtype = dtype
+        self.taps = taps
+        self.chunk_frames = 16384
+
+        # input frames used for an output frame, relative to
+        # the input frame at or before it
+        self.offsets = np.arange(-taps + 1, taps + 1)
+
+        # the output frames fall on `up` different fractions of
+        # an input frame, the weights of each are computed once
+        fractions = np.arange(self.up) / self.up
+        x = fractions[:, np.newaxis] - self.offsets[np.newaxis, :]
+
+        # lowered below the output's nyquist frequency when downsampling
+        cutoff = 0.95 * min(1, fs_out / fs_in)
+
+        beta = 8.6
+        window = np.i0(beta * np.sqrt(np.clip(1 - (x / taps) ** 2, 0, 1)))
+        weights = cutoff * np.sinc(cutoff * x) * window / np.i0(beta)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        self.weights = weights.astype(dtype)
+
+        self.reset(0)
+
+
+    def reset(self, frame: int) -> int:
+        """Continues the output from `frame` as if the input was
+        seeked, returns the input frame to continue reading from"""
+        self.position = frame
+
+        first = frame * self.down // self.up - self.taps + 1
+        self.start = first
+
+        # silence before the start of the input
+        self.buffer = np.zeros((max(-first, 0), self.channels),
+                               dtype=self.dtype)
+
+        return max(first, 0)
+
+
+    def output_frames(self, input_frames: int) -> int:
+        return -(-input_frames * self.up // self.down)
+
+
+    def process(self, block: np.ndarray, final: bool = False) -> np.ndarray:
+        """Returns the output frames that the input so far is enough
+        for, `final` flushes the rest once the input has ended"""
+        if block.shape[0] > 0:
+            self.buffer = np.concatenate([self.buffer, block])
+
+        end = self.start + self.buffer.shape[0]
+
+        if final:
+            last = self.output_frames(end)
+            self.buffer = np.concatenate([
+                self.buffer,
+                np.zeros((self.taps, self.channels), dtype=self.dtype)])
+        else:
+            last = self.output_frames(end - self.taps)
+
+        last = max(last, self.position)
+        out = np.empty((last - self.position, self.channels),
+                       dtype=self.dtype)
+
+        if last > self.position:
+            # (frames, channels, taps) view of the input around each frame
+            windows = sliding_window_view(self.buffer, 2 * self.taps, 
+                                          axis=0)
+
+            # in chunks so that the gathered windows stay small
+            for chunk in range(self.position, last, self.chunk_frames):
+                frames = np.arange(chunk, 
+                                   min(chunk + self.chunk_frames, last))
+                weights = self.weights[frames * self.down % self.up]
+                first = frames * self.down // self.up - self.taps + 1
+
+                out[chunk - self.position:][:frames.shape[0]] = np.matmul(
+                    windows[first - self.start], 
+                    weights[:, :, np.newaxis])[:, :, 0]
+
+        self.position = last
+
+        # input before the first frame the next output needs
+        used = self.position * self.down // self.up - self.taps + 1
+        if used > self.start:
+            self.buffer = self.buffer[used - self.start:]
+            self.start = used
+
+        return out
+
+
+
+# gains of each input channel on the (left, right) outputs, by the 
+# number of input channels in WAV / ffmpeg channel order. Centre and
+# surround channels are mixed in at -3 dB and LFE is dropped
+stereo_downmix = {
+    1: [(1, 1)],
+    2: [(1, 0), (0, 1)],
+    3: [(1, 0), (0, 1), (0.7071, 0.7071)], # L R C
+    4: [(1, 0), (0, 1), (0.7071, 0), (0, 0.7071)], # L R Ls Rs
+    5: [(1, 0), (0, 1), (0.7071, 0.7071), 
+        (0.7071, 0), (0, 0.7071)], # L R C Ls Rs
+    6: [(1, 0), (0, 1), (0.7071, 0.7071), (0, 0),
+        (0.7071, 0), (0, 0.7071)], # L R C LFE Ls Rs
+    7: [(1, 0), (0, 1), (0.7071, 0.7071), (0, 0),
+        (0.5, 0.5), (0.7071, 0), (0, 0.7071)], # L R C LFE Cs Ls Rs
+    8: [(1, 0), (0, 1), (0.7071, 0.7071), (0, 0),
+        (0.7071, 0), (0, 0.7071), 
+        (0.7071, 0), (0, 0.7071)], # L R C LFE Lb Rb Ls Rs
+}
+
+
+@functools.lru_cache
+def mix_matrix(input_channels: int, channels: int) -> np.ndarray:
+    """(input channels, output channels) matrix that maps a layout to
+    another. Downmixes are scaled so that full scale inputs 
+    can't clip, like ffmpeg's default"""
+    if input_channels == channels:
+        matrix = np.eye(channels)
+
+    elif input_channels == 1:
+        matrix = np.ones((1, channels))
+
+    elif channels <= 2 and input_channels in stereo_downmix:
+        matrix = np.array(stereo_downmix[input_channels], dtype=float)
+        matrix /= matrix.sum(axis=0).max()
+
+        if channels == 1:
+            matrix = matrix.mean(axis=1, keepdims=True)
+
+    else:
+        # unknown layouts keep the channels that both have
+        matrix = np.eye(input_channels, channels)
+
+    matrix.setflags(write=False)
+    return matrix
+
+
+def remix(block: np.ndarray, channels: int) -> np.ndarray:
+    """Converts `block` to `channels` channels"""
+    if block.ndim == 1:
+        block = block[:, np.newaxis]
+
+    if block.shape[1] == channels:
+        return block
+
+    matrix = mix_matrix(block.shape[1], channels)
+
+    return np.matmul(block, matrix.astype(block.dtype, copy=False))
+
+
+
+def convert(audio_data: np.ndarray,
+            fs: int,
+            output_fs: int,
+            channels: int) -> np.ndarray:
+    """Converts a whole track to `output_fs` and `channels`"""
+    audio_data = remix(audio_data, channels)
+
+    if fs != output_fs:
+        resampler = Resampler(fs, output_fs, channels,
+                              audio_data.dtype.name)
+        audio_data = resampler.process(audio_data, final=True)
+
+    return audio_data
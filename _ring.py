@@ -0,0 +1,111 @@
+import numpy as np
+
+
+
+class RingBuffer:
+    """Single producer, single consumer queue of audio blocks in a
+    preallocated array. Each side only moves its own index, so
+    neither needs a lock and the consumer never waits on the producer.
+
+    Every block is tagged with the track position it starts at, 
+    the track frames each of its frames plays, the play queue item 
+    it belongs to and a generation. Blocks of an older generation 
+    than the one being read are skipped, which discards them after 
+    a seek or track swap"""
+
+    def __init__(self,
+                 slots: int,
+                 blocksize: int,
+                 channels: int,
+                 dtype: str = "float32") -> None:
+
+        self.slots = slots
+        self.data = np.zeros((slots, blocksize, channels), dtype=dtype)
+
+        # lists so that reading them in the callback doesn't
+        # create numpy scalars
+        self.frames = [0] * slots
+        self.positions = [0] * slots
+        self.rates = [1] * slots
+        self.items = [0] * slots
+        self.generations = [0] * slots
+
+        # blocks written and read so far,
+        # the slot of a block is its index modulo `slots`
+        self.write_index = 0
+        self.read_index = 0
+
+        # consumer side, frames already read from the current block,
+        # the track position after the last frame read and its item
+        self.offset = 0
+        self.position = 0
+        self.item = 0
+
+
+    def __len__(self) -> int:
+        return self.write_index - self.read_index
+
+
+    def empty(self) -> bool:
+        return self.write_index == self.read_index
+
+
+    def full(self) -> bool:
+        return self.write_index - self.read_index >= self.slots
+
+
+    def slot(self) -> np.ndarray:
+        """The block to fill next, only valid while not full"""
+        return self.data[self.write_index % self.slots]
+
+
+    def commit(self, 
+               frames: int, 
+               position: int, 
+               item: int,
+               generation: int,
+               rate: float = 1) -> None:
+        """Publishes the first `frames` frames of `slot()`, `rate` 
+        is the track frames played per frame when time stretched"""
+        slot = self.write_index % self.slots
+
+        self.frames[slot] = frames
+        self.positions[slot] = position
+        self.rates[slot] = rate
+        self.items[slot] = item
+        self.generations[slot] = generation
+
+        # the metadata is set before the index makes it visible
+        self.write_index += 1
+
+
+    def read_into(self, out: np.ndarray, generation: int) -> int:
+        """Copies blocks of `generation` into `out`,
+        returns the number of frames written"""
+        written = 0
+
+        while written < out.shape[0] and self.read_index < self.write_index:
+            slot = self.read_index % self.slots
+
+            if self.generations[slot] != generation:
+                self.read_index += 1
+                self.offset = 0
+                continue
+
+            frames = min(out.shape[0] - written,
+                         self.frames[slot] - self.offset)
+
+            out[written:written + frames] = (
+                self.data[slot, self.offset:self.offset + frames])
+
+            written += frames
+            self.offset += frames
+            self.position = (self.positions[slot] 
+                             + int(self.offset * self.rates[slot]))
+            self.item = self.items[slot]
+
+            if self.offset >= self.frames[slot]:
+                self.read_index += 1
+                self.offset = 0
+
+        return written
@@ -0,0 +1,304 @@
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.managers import BaseManager
+import multiprocessing
+import threading
+import heapq
+from typing import Callable, Any
+
+from _decoder import decode_shared
+
+
+
+# worker processes start fresh instead of forking a process that runs
+# Tk and the audio threads, which is the only way on Windows anyway
+mp_context = multiprocessing.get_context("spawn")
+
+
+
+class SharedBlocks:
+    """Shared memory blocks of decoded preloads, created and held open
+    in the block manager's process. On Windows a block is destroyed as 
+    soon as no process has it open, so it can't be left to the worker 
+    that fills it"""
+
+    def __init__(self) -> None:
+        self.blocks: dict[str, SharedMemory] = {}
+
+
+    def create(self, size: int) -> str:
+        shm = SharedMemory(create=True, size=size)
+        self.blocks[shm.name] = shm
+        return shm.name
+
+
+    def release(self, name: str) -> None:
+        shm = self.blocks.pop(name, None)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+    def release_all(self) -> None:
+        for name in list(self.blocks):
+            self.release(name)
+
+
+
+class BlockManager(BaseManager):
+    pass
+
+
+BlockManager.register("SharedBlocks", SharedBlocks)
+
+
+
+class PreloadScheduler:
+    """Runs preload decodes in worker processes, highest priority 
+    (lowest number) first. Jobs that are no longer wanted are 
+    cancelled, including the ones already decoding"""
+
+    def __init__(self, 
+                 workers: int, 
+                 on_done: Callable[[], None] | None = None) -> None:
+        
+        self.workers = workers
+        self.on_done = on_done
+
+        self.pool: ProcessPoolExecutor | None = None
+
+        self.manager: BlockManager | None = None
+        self.blocks: Any = None # proxy of the manager's SharedBlocks
+
+        self.pending: list[tuple[int, str, str, list[str]]] = []
+        self.running: dict[str, PreloadScheduler.Job] = {}
+
+        self.lock = threading.RLock()
+
+
+    class Job:
+
+        def __init__(self, 
+                     path: str, 
+                     source: str, 
+                     future: Future, 
+                     cancel_flag: SharedMemory) -> None:
+            
+            self.path = path
+            self.source = source
+            self.future = future
+
+            # read by the worker between decoded blocks
+            self.cancel_flag = cancel_flag
+            self.cancelled = False
+
+
+        def cancel(self) -> None:
+            self.cancelled = True
+            if not self.future.cancel():
+                self.cancel_flag.buf[0] = 1
+
+
+        def release(self) -> None:
+            self.cancel_flag.close()
+            self.cancel_flag.unlink()
+
+
+    def start(self) -> None:
+        self.manager = BlockManager(ctx=mp_context)
+        self.manager.start()
+        self.blocks = self.manager.SharedBlocks()
+
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        mp_context=mp_context)
+
+
+    def release_block(self, name: str) -> None:
+        """Lets go of a block from a finished decode, the player's 
+        own mapping of it stays valid until it closes it"""
+        if self.blocks is None:
+            return
+        
+        try:
+            self.blocks.release(name)
+        except (OSError, EOFError):
+            # the manager already exited with the interpreter
+            pass
+
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.pending.clear()
+            for job in self.running.values():
+                job.cancel()
+                job.release()
+
+            self.running.clear()
+
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+            if self.manager is not None:
+                try:
+                    self.blocks.release_all()
+                except (OSError, EOFError):
+                    pass
+
+                self.manager.shutdown()
+                self.manager = None
+                self.blocks = None
+
+
+    def __contains__(self, path: str) -> bool:
+        with self.lock:
+            return (path in self.running 
+                    or any(job[1] == path for job in self.pending))
+    
+
+    def __len__(self) -> int:
+        return len(self.running) + len(self.pending)
+    
+
+    def schedule(self, 
+                 jobs: list[tuple[int, str, str, list[str]]],
+                 dtype: str,
+                 fs: int,
+                 channels: int) -> None:
+        """Replaces the wanted jobs with `jobs`, a list of 
+        (priority, path, file to decode, decoder order), 
+        the files are decoded to `dtype`, `fs` and `channels`"""
+        with self.lock:
+            wanted = {job[1] for job in jobs}
+
+            for path, job in self.running.items():
+                if path not in wanted and not job.cancelled:
+                    job.cancel()
+
+            self.pending = [
+                job for job in jobs 
+                if job[1] not in self.running 
+                or self.running[job[1]].cancelled]
+            heapq.heapify(self.pending)
+
+            self.submit(dtype, fs, channels)
+
+
+    def submit(self, dtype: str, fs: int, channels: int) -> None:
+        if self.pool is None:
+            return
+        
+        deferred = []
+
+        while self.pending and self.active() < self.workers:
+            job = heapq.heappop(self.pending)
+            priority, path, source, order = job
+
+            if path in self.running:
+                # a cancelled decode of it hasn't stopped yet
+                deferred.append(job)
+                continue
+
+            cancel_flag = SharedMemory(create=True, size=1)
+            cancel_flag.buf[0] = 0
+
+            try:
+                future = self.pool.submit(
+                    decode_shared, source, self.blocks, dtype, order, 
+                    cancel_flag.name, fs, channels)
+            except RuntimeError:
+                # shut down by concurrent.futures as the interpreter exits
+                cancel_flag.close()
+                cancel_flag.unlink()
+                self.pending.clear()
+                return
+            
+            if self.on_done is not None:
+                future.add_done_callback(lambda _: self.on_done())
+
+            self.running[path] = self.Job(path, source, future, cancel_flag)
+
+        for job in deferred:
+            heapq.heappush(self.pending, job)
+
+
+    def active(self) -> int:
+        return sum(not job.cancelled for job in self.running.values())
+    
+
+    def cancel(self, path: str) -> None:
+        with self.lock:
+            self.pending = [job for job in self.pending if job[1] != path]
+            heapq.heapify(self.pending)
+
+            if path in self.running:
+                self.running[path].cancel()
+
+
+    def take(self, job: "PreloadScheduler.Job") -> tuple[Any, bool] | None:
+        """Removes a finished job, returns its result and whether 
+        it raised, or None if it was cancelled"""
+        self.running.pop(job.path)
+        job.release()
+
+        try:
+            result = job.future.result()
+            failed = False
+        except Exception as error:
+            result = error
+            failed = True
+
+        if job.cancelled:
+            if not failed and result is not None:
+                # finished before it saw the cancel flag
+                self.release_block(result[0])
+            return None
+        
+        return result, failed
+    
+
+    def finished(self) -> list[tuple[str, str, Any, bool]]:
+        """Removes the finished jobs, returns their path, decoded file,
+        result and whether it raised"""
+        results = []
+
+        with self.lock:
+            for job in list(self.running.values()):
+                if not job.future.done():
+                    continue
+                
+                taken = self.take(job)
+                if taken is not None:
+                    results.append((job.path, job.source, *taken))
+
+        return results
+    
+
+    def wait(self, 
+             path: str, 
+             timeout: float | None
+             ) -> tuple[str, str, Any, bool] | None:
+        """Waits for a decode of `path` that already started, 
+        so that it doesn't have to be decoded twice"""
+        with self.lock:
+            job = self.running.get(path)
+            if job is None or job.cancelled:
+                return None
+            
+        try:
+            job.future.result(timeout)
+        except TimeoutError:
+            return None
+        except Exception:
+            pass
+
+        with self.lock:
+            if self.running.get(path) is not job:
+                # taken by the preloader in the meantime
+                return None
+            
+            taken = self.take(job)
+            if taken is None:
+                return None
+            
+            return (job.path, job.source, *taken)
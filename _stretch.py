@@ -0,0 +1,275 @@
+import numpy as np
+import bisect
+
+
+
+class TimeStretcher:
+    """Changes the speed of audio without changing its pitch (WSOLA).
+    Frames of the input are overlap-added at a fixed hop, each taken
+    from around where the speed puts it, at the offset that best
+    continues the frame before it.
+
+    Every output chunk keeps the track position and play queue item
+    of the input it came from, so timestamps stay in track time"""
+
+    def __init__(self,
+                 fs: int,
+                 channels: int,
+                 blocksize: int,
+                 dtype: str = "float32") -> None:
+
+        self.channels = channels
+
+        # 40 ms frames at a 20 ms hop, searched 10 ms either side
+        self.hop = int(fs * 0.02)
+        self.frame_size = 2 * self.hop
+        self.tolerance = self.hop // 2
+
+        self.fft_size = 1 << (self.frame_size
+                              + 2 * self.tolerance - 1).bit_length()
+
+        # hann windows at half overlap add up to 1, the first frame
+        # after a reset keeps its start so that it continues the
+        # unstretched audio before it
+        window = 0.5 - 0.5 * np.cos(
+            2 * np.pi * np.arange(self.frame_size) / self.frame_size)
+
+        self.window = np.repeat(window[:, np.newaxis], channels,
+                                axis=1).astype(dtype)
+        self.first_window = self.window.copy()
+        self.first_window[:self.hop] = 1
+
+        # preallocated, the input and output are moved to the front
+        # of their buffers as they are used
+        self.input = np.zeros((4 * self.frame_size + blocksize, channels),
+                              dtype=dtype)
+        self.output = np.zeros((3 * self.frame_size, channels),
+                               dtype=dtype)
+        self.overlap = np.zeros((self.frame_size, channels), dtype=dtype)
+        self.frame = np.zeros((self.frame_size, channels), dtype=dtype)
+
+        # mono mixes of the frames compared in the search
+        self.region = np.zeros(self.fft_size, dtype=dtype)
+        self.target = np.zeros(self.fft_size, dtype=dtype)
+
+        self.reset()
+
+
+    def reset(self) -> None:
+        # input index of the first buffered input frame,
+        # counted from the last reset
+        self.input_start = 0
+        self.input_frames = 0
+
+        # (input index, track position, item) of each block written
+        self.marks: list[tuple[int, int, int]] = []
+
+        # input index the next frame is searched around and the
+        # input index the last frame was taken from
+        self.analysis = 0.0
+        self.previous: int | None = None
+
+        self.overlap[:] = 0
+
+        # [frames, track position, item, input frames per output frame]
+        # of each chunk in the output buffer
+        self.output_frames = 0
+        self.chunks: list[list] = []
+
+
+    def empty(self) -> bool:
+        return self.input_frames == 0 and self.output_frames == 0
+
+
+    def pending(self) -> bool:
+        return self.output_frames > 0
+
+
+    def write(self, block: np.ndarray, position: int, item: int) -> None:
+        """Adds a block of input that starts at `position` of `item`"""
+        frames = block.shape[0]
+
+        self.marks.append((self.input_start + self.input_frames,
+                           position,
+                           item))
+
+        self.input[self.input_frames:self.input_frames + frames] = block
+        self.input_frames += frames
+
+
+    def source(self, index: int) -> tuple[int, int]:
+        """Track position and item of an input index"""
+        mark = bisect.bisect_right(self.marks, index,
+                                   key=lambda mark: mark[0]) - 1
+
+        start, position, item = self.marks[max(mark, 0)]
+        return position + index - start, item
+
+
+    def resume_index(self) -> int:
+        """Input index that continues the output unstretched"""
+        if self.previous is None:
+            return int(self.analysis)
+
+        return self.previous + self.hop
+
+
+    def process(self, speed: float) -> bool:
+        """Adds the next frame to the output, returns False if
+        it needs more input or the output is full"""
+        if self.output_frames + self.hop > self.output.shape[0]:
+            return False
+
+        nominal = int(self.analysis)
+        end = self.input_start + self.input_frames
+
+        if self.previous is None:
+            if end < nominal + self.frame_size:
+                return False
+
+            start = nominal
+            window = self.first_window
+
+        else:
+            natural = self.previous + self.hop
+            low = max(nominal - self.tolerance, self.input_start)
+            high = nominal + self.tolerance
+
+            if end < max(high, natural) + self.frame_size:
+                return False
+
+            start = self.search(natural, low, high)
+            window = self.window
+
+        offset = start - self.input_start
+        np.multiply(self.input[offset:offset + self.frame_size], window,
+                    out=self.frame)
+        np.add(self.overlap, self.frame, out=self.overlap)
+
+        # the first half of the overlap is complete, its track position
+        # is the searched around one so that timestamps keep increasing
+        position, item = self.source(nominal)
+        self.add_output(self.overlap[:self.hop], position, item, speed)
+
+        self.overlap[:self.hop] = self.overlap[self.hop:]
+        self.overlap[self.hop:] = 0
+
+        self.previous = start
+        self.analysis += speed * self.hop
+
+        self.trim(min(int(self.analysis) - self.tolerance,
+                      start + self.hop))
+
+        return True
+
+
+    def search(self, natural: int, low: int, high: int) -> int:
+        """Input index between `low` and `high` whose frame is the
+        most similar to the one at `natural`"""
+        offset = low - self.input_start
+        length = high - low + self.frame_size
+
+        np.sum(self.input[offset:offset + length], axis=1,
+               out=self.region[:length])
+        self.region[length:] = 0
+
+        offset = natural - self.input_start
+        np.sum(self.input[offset:offset + self.frame_size], axis=1,
+               out=self.target[:self.frame_size])
+        self.target[self.frame_size:] = 0
+
+        # cross correlation at every lag in one product of spectra
+        correlation = np.fft.irfft(
+            np.fft.rfft(self.region) * np.conj(np.fft.rfft(self.target)),
+            self.fft_size)
+
+        return low + int(np.argmax(correlation[:high - low + 1]))
+
+
+    def finish(self) -> bool:
+        """Moves the input that wasn't stretched yet to the output
+        unchanged, which continues the last frame without a seam.
+        Returns False if the output has no room for it yet"""
+        start = self.resume_index()
+        end = self.input_start + self.input_frames
+
+        if self.output_frames + max(end - start, 0) > self.output.shape[0]:
+            return False
+
+        # split where the input changes track
+        bounds = [index for index, position, item in self.marks
+                  if start < index < end] + [end]
+
+        for bound in bounds:
+            if bound <= start:
+                continue
+
+            position, item = self.source(start)
+            offset = start - self.input_start
+            self.add_output(self.input[offset:offset + bound - start],
+                            position, item, 1)
+            start = bound
+
+        self.input_start = end
+        self.input_frames = 0
+        self.marks.clear()
+        self.analysis = end
+        self.previous = None
+        self.overlap[:] = 0
+
+        return True
+
+
+    def add_output(self,
+                   block: np.ndarray,
+                   position: int,
+                   item: int,
+                   rate: float) -> None:
+
+        frames = block.shape[0]
+        self.output[self.output_frames:self.output_frames + frames] = block
+        self.output_frames += frames
+
+        self.chunks.append([frames, position, item, rate])
+
+
+    def trim(self, keep: int) -> None:
+        """Drops the input before input index `keep`"""
+        dropped = keep - self.input_start
+        if dropped <= 0:
+            return
+
+        remaining = self.input_frames - dropped
+        self.input[:remaining] = self.input[dropped:self.input_frames]
+        self.input_frames = remaining
+        self.input_start = keep
+
+        mark = bisect.bisect_right(self.marks, keep,
+                                   key=lambda mark: mark[0]) - 1
+        if mark > 0:
+            del self.marks[:mark]
+
+
+    def read_into(self, out: np.ndarray) -> tuple[int, int, int, float]:
+        """Copies output of a single chunk into `out`, returns the
+        frames copied, the track position and item of the first one
+        and the track frames played per frame"""
+        if not self.chunks:
+            return 0, 0, 0, 1
+
+        chunk = self.chunks[0]
+        frames, position, item, rate = chunk
+        frames = min(frames, out.shape[0])
+
+        out[:frames] = self.output[:frames]
+
+        remaining = self.output_frames - frames
+        self.output[:remaining] = self.output[frames:self.output_frames]
+        self.output_frames = remaining
+
+        chunk[0] -= frames
+        chunk[1] += round(frames * rate)
+        if chunk[0] == 0:
+            self.chunks.pop(0)
+
+        return frames, position, item, rate
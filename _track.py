@@ -0,0 +1,464 @@
+import numpy as np
+import soundfile as sf
+import threading
+import queue
+from typing import Callable
+
+from _decoder import Decoder, DecodeError
+from _cache import PCMCache
+
+
+
+class Track:
+    """Audio source read by `AudioPlayer.stream_callback`"""
+
+    def __init__(self, fs: int, channels: int, frames: int) -> None:
+        self.fs = fs
+        self.channels = channels
+        self.frames = frames
+
+
+    def read_into(self, out: np.ndarray, start: int) -> int:
+        """Copies the frames from `start` into `out`, 
+        returns the number of frames written"""
+        return 0
+
+
+    def seek(self, frame: int) -> None:
+        pass
+
+
+    def ended(self, position: int) -> bool:
+        return self.frames <= position
+    
+
+    def buffering(self, position: int) -> bool:
+        """Whether playback at `position` is waiting for the decoder"""
+        return False
+
+
+    def close(self) -> None:
+        pass
+
+
+
+class ArrayTrack(Track):
+    """A track that is fully decoded in memory"""
+
+    def __init__(self, data: np.ndarray, fs: int) -> None:
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+
+        super().__init__(fs, data.shape[1], data.shape[0])
+
+        self.data = data
+
+
+    def read_into(self, out: np.ndarray, start: int) -> int:
+        chunk = self.data[start:start + out.shape[0]]
+        frames = chunk.shape[0]
+
+        out[:frames] = chunk
+        return frames
+
+
+
+class StreamTrack(Track):
+    """A track decoded on a separate thread into a bounded buffer,
+    so memory use does not depend on the length of the track"""
+
+    def __init__(self, 
+                 decoder: Decoder, 
+                 blocksize: int,
+                 buffer_blocks: int = 32,
+                 writer: PCMCache.Writer | None = None) -> None:
+        
+        super().__init__(decoder.fs, decoder.channels, decoder.frames)
+
+        self.decoder = decoder
+        self.blocksize = blocksize
+
+        # copies the decoded blocks into the PCM cache, 
+        # only complete uninterrupted decodes are committed
+        self.writer = writer
+
+        # blocks are tagged with a generation so that
+        # blocks decoded before a seek can be discarded
+        self.buffer: queue.Queue[tuple[int, np.ndarray]] = queue.Queue(
+            maxsize=buffer_blocks)
+        self.generation = 0
+        self.seek_frame: int | None = None
+
+        self.block = np.zeros((0, self.channels))
+        self.offset = 0
+        self.position = 0
+
+        self.done = False
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+
+        self.thread = threading.Thread(
+            target=self.decode_loop,
+            daemon=True)
+        self.thread.start()
+
+
+    def decode_loop(self) -> None:
+        while not self.closed:
+            with self.lock:
+                generation = self.generation
+
+                try:
+                    if self.seek_frame is not None:
+                        frame = self.seek_frame
+                        self.seek_frame = None
+                        self.decoder.seek(frame)
+
+                    block = self.decoder.read(self.blocksize)
+                except (sf.LibsndfileError, DecodeError):
+                    # corrupt past its header, it ends where it broke
+                    # and the incomplete audio isn't cached
+                    block = np.zeros((0, self.channels))
+
+                    if self.writer is not None:
+                        self.writer.abort()
+                        self.writer = None
+
+                if self.writer is not None:
+                    if block.shape[0] == 0:
+                        self.writer.commit()
+                        self.writer = None
+                    else:
+                        self.writer.write(block)
+
+            if block.shape[0] == 0:
+                with self.lock:
+                    if generation == self.generation:
+                        self.done = True
+
+                self.wake.wait()
+                self.wake.clear()
+                continue
+
+            # blocks when the buffer is full, seek() and close()
+            # drain the buffer to unblock this thread
+            self.buffer.put((generation, block))
+
+        with self.lock:
+            if self.writer is not None:
+                self.writer.abort()
+                self.writer = None
+
+        self.decoder.close()
+
+
+    def drain(self) -> None:
+        while True:
+            try:
+                self.buffer.get_nowait()
+            except queue.Empty:
+                return
+
+
+    def read_into(self, out: np.ndarray, start: int) -> int:
+        written = 0
+
+        while written < out.shape[0]:
+            if self.offset >= self.block.shape[0]:
+                try:
+                    generation, block = self.buffer.get_nowait()
+                except queue.Empty:
+                    break
+
+                if generation != self.generation:
+                    continue
+
+                self.block = block
+                self.offset = 0
+
+            frames = min(out.shape[0] - written, 
+                         self.block.shape[0] - self.offset)
+            
+            out[written:written + frames] = (
+                self.block[self.offset:self.offset + frames])
+
+            written += frames
+            self.offset += frames
+
+        self.position += written
+        return written
+
+
+    def seek(self, frame: int) -> None:
+        if frame == self.position:
+            return
+        
+        self.position = frame
+        
+        with self.lock:
+            self.generation += 1
+            self.seek_frame = frame
+            self.done = False
+
+            if self.writer is not None:
+                self.writer.abort()
+                self.writer = None
+
+            self.block = np.zeros((0, self.channels))
+            self.offset = 0
+
+        self.drain()
+        self.wake.set()
+
+
+    def ended(self, position: int) -> bool:
+        return (self.done 
+                and self.buffer.empty() 
+                and self.offset >= self.block.shape[0])
+    
+
+    def buffering(self, position: int) -> bool:
+        return (not self.done 
+                and self.buffer.empty() 
+                and self.offset >= self.block.shape[0])
+
+
+    def close(self) -> None:
+        self.closed = True
+        self.drain()
+        self.wake.set()
+
+
+
+
+class LazyTrack(Track):
+    """A track decoded in the background into a full length buffer,
+    starting from the position that is played. Seeking to a part 
+    that is not decoded yet moves the decoder there, the skipped 
+    parts are filled in after the end of the file is reached"""
+
+    def __init__(self,
+                 decoder: Decoder,
+                 blocksize: int,
+                 on_complete: Callable[[np.ndarray, int], None] | None = None
+                 ) -> None:
+        
+        super().__init__(decoder.fs, decoder.channels, decoder.frames)
+
+        self.decoder = decoder
+        self.blocksize = blocksize
+        self.on_complete = on_complete
+
+        self.data = np.empty((self.frames, self.channels), 
+                             dtype=decoder.dtype)
+        
+        blocks = -(-self.frames // blocksize)
+        self.filled = np.zeros(blocks, dtype=bool)
+
+        self.target = 0 # next block to decode
+        self.decoder_block = 0 # block the decoder is positioned at
+
+        self.failed = False
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target=self.decode_loop,
+            daemon=True)
+        self.thread.start()
+
+
+    def next_block(self) -> int | None:
+        """First block that is not decoded, 
+        searching from the target and wrapping around"""
+        missing = np.flatnonzero(~self.filled[self.target:])
+        if missing.shape[0] > 0:
+            return self.target + int(missing[0])
+        
+        missing = np.flatnonzero(~self.filled[:self.target])
+        if missing.shape[0] > 0:
+            return int(missing[0])
+        
+        return None
+
+
+    def decode_loop(self) -> None:
+        while not self.closed:
+            block_index = self.next_block()
+            if block_index is None:
+                break
+
+            start = block_index * self.blocksize
+
+            try:
+                if block_index != self.decoder_block:
+                    self.decoder.seek(start)
+
+                block = self.decoder.read(min(self.blocksize, 
+                                              self.frames - start))
+            except (sf.LibsndfileError, DecodeError):
+                # the decoder can't continue after an error, 
+                # playback ends at the first block that is missing
+                self.failed = True
+                break
+
+            frames = block.shape[0]
+
+            self.data[start:start + frames] = block
+            self.decoder_block = block_index + 1
+
+            if frames < min(self.blocksize, self.frames - start):
+                # the file ended earlier than it reported
+                self.frames = start + frames
+                self.filled = self.filled[:block_index + 1]
+                
+            self.filled[block_index] = True
+
+            if self.target == block_index:
+                self.target = block_index + 1
+
+        self.decoder.close()
+
+        # only complete decodes are cached
+        if (not self.closed 
+                and not self.failed 
+                and self.on_complete is not None):
+            self.on_complete(self.data[:self.frames], self.fs)
+
+
+    def read_into(self, out: np.ndarray, start: int) -> int:
+        end = min(start + out.shape[0], self.frames)
+        if end <= start:
+            return 0
+
+        # only read up to the first block that is not decoded yet
+        first = start // self.blocksize
+        last = -(-end // self.blocksize)
+
+        if not self.filled[first:last].all():
+            missing = int(np.argmin(self.filled[first:last]))
+            end = min(end, (first + missing) * self.blocksize)
+
+        frames = max(end - start, 0)
+        out[:frames] = self.data[start:end]
+
+        return frames
+
+
+    def seek(self, frame: int) -> None:
+        self.target = min(frame // self.blocksize, 
+                          max(self.filled.shape[0] - 1, 0))
+        
+
+    def ended(self, position: int) -> bool:
+        block_index = position // self.blocksize
+        return (self.frames <= position 
+                or (self.failed and not self.filled[block_index]))
+
+
+    def buffering(self, position: int) -> bool:
+        block_index = position // self.blocksize
+        return (block_index < self.filled.shape[0] 
+                and not self.filled[block_index]
+                and not self.failed)
+
+
+    def close(self) -> None:
+        self.closed = True
+
+
+
+
+class ProgressiveTrack(Track):
+    """A track decoded in the background into a buffer that grows 
+    as blocks are decoded, playable as soon as the first block is"""
+
+    def __init__(self,
+                 decoder: Decoder,
+                 blocksize: int,
+                 on_complete: Callable[[np.ndarray, int], None] | None = None
+                 ) -> None:
+        
+        super().__init__(decoder.fs, decoder.channels, decoder.frames)
+
+        self.decoder = decoder
+        self.blocksize = blocksize
+        self.on_complete = on_complete
+
+        # `frames` is an estimate until the decoder is done
+        self.data = np.empty((max(self.frames, blocksize), self.channels),
+                             dtype=decoder.dtype)
+        self.available = 0
+
+        self.done = False
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target=self.decode_loop,
+            daemon=True)
+        self.thread.start()
+
+
+    def decode_loop(self) -> None:
+        failed = False
+
+        while not self.closed:
+            try:
+                block = self.decoder.read(self.blocksize)
+            except (sf.LibsndfileError, DecodeError):
+                # corrupt past its header, it ends where it broke
+                failed = True
+                break
+
+            frames = block.shape[0]
+            if frames == 0:
+                break
+
+            end = self.available + frames
+            if end > self.data.shape[0]:
+                # the decoded frames are copied before the buffer is
+                # swapped and `available` only moves past them after,
+                # so readers that read `available` before `data` find 
+                # them in either buffer
+                grown = np.empty((int(end * 1.5), self.channels),
+                                 dtype=self.data.dtype)
+                grown[:self.available] = self.data[:self.available]
+                self.data = grown
+
+            self.data[self.available:end] = block
+            self.available = end
+
+            self.frames = max(self.frames, end)
+
+        self.decoder.close()
+
+        if not self.closed:
+            self.frames = self.available
+            self.done = True
+
+            # only complete decodes are cached
+            if not failed and self.on_complete is not None:
+                self.on_complete(self.data[:self.available], self.fs)
+
+
+    def read_into(self, out: np.ndarray, start: int) -> int:
+        end = min(start + out.shape[0], self.available)
+        data = self.data
+
+        frames = max(end - start, 0)
+        out[:frames] = data[start:end]
+
+        return frames
+
+
+    def ended(self, position: int) -> bool:
+        return self.done and self.available <= position
+    
+
+    def buffering(self, position: int) -> bool:
+        return not self.done and self.available <= position
+
+
+    def close(self) -> None:
+        self.closed = True
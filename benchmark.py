@@ -0,0 +1,199 @@
+"""Micro-benchmarks of the playback hot paths,
+run with `python benchmark.py`"""
+import numpy as np
+import tracemalloc
+import time
+import sys
+
+from _backend import Backend
+from _track import ArrayTrack
+from _equalizer import Equalizer, presets
+
+
+
+def prepare_call(player: Backend.AudioPlayer, call: int, ramp: bool) -> None:
+    # the render thread's work, not measured
+    player.render()
+
+    if ramp:
+        # a volume change before every callback
+        player.volume = 0.25 + 0.5 * (call % 2)
+
+
+# only the data of numpy arrays, views and Python objects don't count
+numpy_data = tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)
+
+
+def array_data() -> int:
+    """Bytes of array data allocated since tracing started 
+    and not freed yet"""
+    snapshot = tracemalloc.take_snapshot().filter_traces([numpy_data])
+    return sum(trace.size for trace in snapshot.traces)
+
+
+def callback_allocations(player: Backend.AudioPlayer,
+                         frames: int,
+                         calls: int,
+                         ramp: bool = False) -> int:
+    """Returns the most array data held at any bytecode of one 
+    callback, so temporaries freed before it returns are counted"""
+    outdata = np.empty((frames, player.channels), dtype=player.dtype)
+
+    peak = 0
+
+    def trace(frame, event, arg):
+        nonlocal peak
+        frame.f_trace_opcodes = True
+        peak = max(peak, array_data())
+        return trace
+
+    for call in range(calls):
+        prepare_call(player, call, ramp)
+
+        # traces only what is allocated from here on, 
+        # which keeps the snapshots small
+        tracemalloc.start()
+        sys.settrace(trace)
+
+        player.stream_callback(outdata, frames, None, None)
+
+        sys.settrace(None)
+        peak = max(peak, array_data())
+        tracemalloc.stop()
+
+    return peak
+
+
+def callback_time(player: Backend.AudioPlayer,
+                  frames: int,
+                  calls: int,
+                  ramp: bool = False) -> float:
+    outdata = np.empty((frames, player.channels), dtype=player.dtype)
+
+    seconds = 0
+
+    for call in range(calls):
+        prepare_call(player, call, ramp)
+
+        start = time.perf_counter()
+        player.stream_callback(outdata, frames, None, None)
+        seconds += time.perf_counter() - start
+
+    return seconds / calls
+
+
+def benchmark_callback(calls: int = 10000, traced_calls: int = 200) -> None:
+    player = Backend.AudioPlayer(None)
+    frames = player.blocksize
+
+    audio_data = np.random.default_rng(0).uniform(
+        -1, 1, (player.fs * 600, player.channels)).astype(player.dtype)
+
+    player.set_track(ArrayTrack(audio_data, player.fs), "")
+    player.volume = 0.5
+    player.play()
+
+    block_bytes = frames * player.channels * np.dtype(player.dtype).itemsize
+
+    print(f"stream_callback, {frames} frames "
+          f"({block_bytes} bytes per block)")
+
+    for ramp in [False, True]:
+        # warm up numpy's internal caches
+        callback_time(player, frames, 100, ramp)
+
+        peak = callback_allocations(player, frames, traced_calls, ramp)
+        seconds = callback_time(player, frames, calls, ramp)
+
+        print("  volume ramping every call" if ramp else "  fixed volume")
+        print(f"    time per callback:           {seconds * 1e6:.1f} us")
+        print(f"    array data allocated in one: {peak} bytes")
+
+        if peak != 0:
+            raise SystemExit("stream_callback allocates arrays")
+
+    print("  no arrays allocated")
+
+
+def benchmark_stretch(seconds: int = 60) -> None:
+    """Render thread time per block at each playback speed, which has
+    to stay well inside the time the block takes to play"""
+    player = Backend.AudioPlayer(None)
+    frames = player.blocksize
+    budget = frames / player.fs
+
+    # without a play queue to continue into
+    player.gapless = False
+
+    audio_data = np.random.default_rng(0).uniform(
+        -1, 1, (player.fs * seconds, player.channels)).astype(player.dtype)
+    outdata = np.empty((frames, player.channels), dtype=player.dtype)
+
+    print(f"render with time stretching, {frames} frames "
+          f"({budget * 1e3:.1f} ms per block)")
+
+    for speed in [1, 0.5, 1.5, 2]:
+        player.set_track(ArrayTrack(audio_data, player.fs), "")
+        player.set_speed(speed)
+
+        blocks = 0
+        elapsed = 0
+
+        while not player.track.ended(player.render_position):
+            start = time.perf_counter()
+            player.render()
+            elapsed += time.perf_counter() - start
+
+            # the callback's side, not measured
+            while player.ring.read_into(outdata, player.generation) > 0:
+                blocks += 1
+
+        per_block = elapsed / blocks
+        print(f"  {speed:g}x: {per_block * 1e6:.1f} us per block "
+              f"({per_block / budget:.1%} of the block)")
+
+        if per_block >= budget:
+            raise SystemExit("time stretching is slower than real time")
+
+
+def benchmark_equalizer(blocks: int = 5000) -> None:
+    """Equalizer time per stream_callback block at common sample 
+    rates, it runs in the render thread for each block"""
+    print("equalizer, one stream_callback block")
+
+    for fs in [44100, 96000]:
+        frames = int(fs / 100)
+        budget = frames / fs
+
+        equalizer = Equalizer(fs, 2, frames)
+        equalizer.set_gains(presets["rock"])
+
+        audio_data = np.random.default_rng(0).uniform(
+            -1, 1, (frames, 2)).astype("float32")
+        block = np.empty_like(audio_data)
+
+        # warm up the filter design cache and numpy's FFT plans
+        equalizer.process(audio_data.copy())
+
+        seconds = 0
+
+        for _ in range(blocks):
+            block[:] = audio_data
+
+            start = time.perf_counter()
+            equalizer.process(block)
+            seconds += time.perf_counter() - start
+
+        per_block = seconds / blocks
+        print(f"  {fs} Hz, {frames} frames: {per_block * 1e6:.1f} us "
+              f"({per_block / budget:.1%} of the block)")
+
+        if per_block >= budget:
+            raise SystemExit("the equalizer is slower than real time")
+
+
+
+if __name__ == "__main__":
+    benchmark_callback()
+    benchmark_stretch()
+    benchmark_equalizer()
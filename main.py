@@ -6,11 +6,14 @@ from typing import Callable, Any, Type
 from abc import ABC, abstractmethod
 
 import _backend
+from _equalizer import presets
 from DisplayFrame import DisplayFrame
 
 
 
-Backend = _backend.Backend()
+# created in main(), the preloader's worker processes import 
+# this module and mustn't build a player of their own
+Backend: _backend.Backend
 
 self_path = _backend.self_path
 img_path = os.path.join(self_path, "img")
@@ -467,8 +470,14 @@ class MainWindow:
             self.timestamp = 0
             self.duration = 0
             self.volume = 1
+            self.speed = 1
+            self.equalizer_preset = "flat"
+            self.loading = "stream"
             self.playing = False
 
+            # playback speeds that the speed button steps through
+            self.speeds = [0.5, 0.75, 1, 1.25, 1.5, 1.75, 2]
+
             self.master = MainWindow.grid_frame
 
             self.border_frame = tk.Frame(self.master, 
@@ -541,6 +550,78 @@ class MainWindow:
                     Backend._AudioPlayer.current_path
                 )
             )
+
+            self.speed_btn = tk.Label(
+                self.default_volume_frame,
+                text="Speed 1x",
+                width=10,
+                bg=self.colour_theme["menu_bg"],
+                fg=self.colour_theme["fg"]
+            )
+
+            self.speed_btn.bind(
+                "<Enter>", 
+                lambda _: self.speed_btn.config(
+                    bg=self.colour_theme["hover_bg"]))
+            
+            self.speed_btn.bind(
+                "<Leave>", 
+                lambda _: self.speed_btn.config(
+                    bg=self.colour_theme["menu_bg"]))
+            
+            self.speed_btn.bind("<Button-1>",
+                                lambda _: self.step_speed(1))
+            
+            self.speed_btn.bind("<Button-3>",
+                                lambda _: self.step_speed(-1))
+            
+            self.equalizer_btn = tk.Label(
+                self.default_volume_frame,
+                text="EQ flat",
+                width=16,
+                bg=self.colour_theme["menu_bg"],
+                fg=self.colour_theme["fg"]
+            )
+
+            self.equalizer_btn.bind(
+                "<Enter>", 
+                lambda _: self.equalizer_btn.config(
+                    bg=self.colour_theme["hover_bg"]))
+            
+            self.equalizer_btn.bind(
+                "<Leave>", 
+                lambda _: self.equalizer_btn.config(
+                    bg=self.colour_theme["menu_bg"]))
+            
+            self.equalizer_btn.bind("<Button-1>",
+                                    lambda _: self.step_equalizer(1))
+            
+            self.equalizer_btn.bind("<Button-3>",
+                                    lambda _: self.step_equalizer(-1))
+            
+            self.loading_btn = tk.Label(
+                self.default_volume_frame,
+                text="Load stream",
+                width=16,
+                bg=self.colour_theme["menu_bg"],
+                fg=self.colour_theme["fg"]
+            )
+
+            self.loading_btn.bind(
+                "<Enter>", 
+                lambda _: self.loading_btn.config(
+                    bg=self.colour_theme["hover_bg"]))
+            
+            self.loading_btn.bind(
+                "<Leave>", 
+                lambda _: self.loading_btn.config(
+                    bg=self.colour_theme["menu_bg"]))
+            
+            self.loading_btn.bind("<Button-1>",
+                                  lambda _: self.step_loading(1))
+            
+            self.loading_btn.bind("<Button-3>",
+                                  lambda _: self.step_loading(-1))
             
 
             self.last_btn_img = tk.PhotoImage(
@@ -789,6 +870,16 @@ class MainWindow:
                                  sticky="nesw",
                                  padx=2)
             
+            self.speed_btn.grid(column=3, row=0,
+                                sticky="nesw")
+            
+            self.equalizer_btn.grid(column=4, row=0,
+                                    sticky="nesw",
+                                    padx=2)
+            
+            self.loading_btn.grid(column=5, row=0,
+                                  sticky="nesw")
+            
 
             self.filename_lbl.grid(column=0, row=2, sticky="w")
             self.last_btn.grid(column=2, row=2)
@@ -806,6 +897,9 @@ class MainWindow:
             self.duration = Backend._AudioPlayer.get_duration()
             self.playing = Backend._AudioPlayer.playing
             self.volume = Backend._AudioPlayer.volume
+            self.speed = Backend._AudioPlayer.speed
+            self.equalizer_preset = Backend._AudioPlayer.equalizer_preset
+            self.loading = Backend._AudioPlayer.loading
 
             if self.duration != 0:
                 self.progress_slider.set_arrow_interval(1 / self.duration)
@@ -836,6 +930,32 @@ class MainWindow:
             self.goto_time(frame_time)
 
 
+        def step_speed(self, step: int) -> None:
+            index = min(range(len(self.speeds)), 
+                        key=lambda i: abs(self.speeds[i] - self.speed))
+            index = min(max(index + step, 0), len(self.speeds) - 1)
+
+            Backend._AudioPlayer.set_speed(self.speeds[index])
+
+
+        def step_equalizer(self, step: int) -> None:
+            names = list(presets)
+
+            index = 0
+            if self.equalizer_preset in names:
+                index = names.index(self.equalizer_preset) + step
+
+            Backend._AudioPlayer.set_equalizer_preset(
+                names[index % len(names)])
+
+
+        def step_loading(self, step: int) -> None:
+            modes = _backend.loading_modes
+            index = modes.index(self.loading) + step
+
+            Backend._AudioPlayer.set_loading(modes[index % len(modes)])
+
+
         def slider_set_volume(self, value: float) -> None:
             self.volume = value * 2
             Backend._AudioPlayer.set_volume(self.volume)
@@ -854,9 +974,14 @@ class MainWindow:
 
             self.volume_slider.set_value(self.volume / 2)
             self.volume_lbl.config(text=f"{round(self.volume * 100)}%")
+            self.speed_btn.config(text=f"Speed {self.speed:g}x")
+            self.equalizer_btn.config(text=f"EQ {self.equalizer_preset}")
+            self.loading_btn.config(text=f"Load {self.loading}")
 
 
             filename = os.path.basename(Backend._AudioPlayer.current_path)
+            if Backend._AudioPlayer.is_buffering():
+                filename += " (buffering)"
             self.filename_lbl.config(text=filename)
 
 
@@ -1135,11 +1260,19 @@ class MainWindow:
 
                 def update(self) -> None:
                     if self.id < len(self.input_data):
-                        filename = os.path.basename(
-                            self.input_data[self.id])
+                        path = self.input_data[self.id]
+                        filename = os.path.basename(path)
                         
                         self.name_lbl.config(text=filename)
 
+                        # mark files that could not be decoded
+                        if Backend._AudioPlayer.has_failed(path):
+                            self.name_lbl.config(
+                                fg=self.colour_theme["red"])
+                        else:
+                            self.name_lbl.config(
+                                fg=self.colour_theme["fg"])
+
                     else:
                         self.name_lbl.config(text="")
                         self.leave_func(None)
@@ -2723,6 +2856,9 @@ class MainWindow:
             
 
 def main():
+    global Backend
+    Backend = _backend.Backend()
+
     window = MainWindow((1000, 500), colour_theme)
     window.init_window()
 